@@ -1,22 +1,27 @@
 # --- IMPORTS ---
 import os
 import io
+import math
+import re
+import hashlib
+import unicodedata
 import uuid
 import json
 import time
 import torch
 import tempfile
 import asyncio
-from typing import List, Dict, TypedDict
+import threading
+import contextlib
+from typing import List, Dict, TypedDict, Annotated
 from datetime import datetime
 from PIL import Image
 import fitz  # PyMuPDF
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from google.generativeai import configure, GenerativeModel
 from langchain_huggingface import HuggingFaceEmbeddings
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import Distance, VectorParams, PointStruct, QueryRequest
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain_community.vectorstores import Qdrant
@@ -24,11 +29,27 @@ from pdf2image import convert_from_path
 from langgraph.checkpoint.mongodb.aio import AsyncMongoDBSaver
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, RemoveMessage
 from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.graph.message import add_messages
+from langchain_core.runnables import RunnableConfig
 from langchain_core.runnables import Runnable
 from sentence_transformers import SentenceTransformer, util
 from langchain.retrievers.multi_query import MultiQueryRetriever
+from backend.utils.batcher import MicroBatcher
+from backend.utils.metrics import counter, histogram
+from backend.utils.timing import stage, timed
+from language_gate import gate_query
+from llm_gateway import LLMGateway, PRIORITY_CHAT, PRIORITY_BACKGROUND, PRIORITY_INGEST
+from ocr_engines import GeminiEngine, TesseractEngine, OCRRouter
+from model_server import (
+    EMBEDDING_MODEL_NAME,
+    RERANKER_MODEL_NAME,
+    ModelClient,
+    RemoteEmbeddings,
+    RemoteSentenceEncoder,
+)
 
 # --- ENVIRONMENT SETUP ---
 load_dotenv()
@@ -43,15 +64,8 @@ if google_creds:
 
 # --- FUNCTION AND CLASS DEFINITIONS ---
 def load_model():
-    """Load and return the Gemini 2.0 Flash model using LangChain wrapper."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise EnvironmentError("GEMINI_API_KEY not found in environment variables.")
-    model = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        google_api_key=api_key,
-    )
-    return model
+    """Return the shared Gemini 2.0 Flash LangChain model (created once by the LLM gateway)."""
+    return llm_gateway.chat_model()
 
 def convert_pdf_to_images(pdf_path, output_folder, dpi=300):
     """Convert scanned PDF to high-res images."""
@@ -63,13 +77,8 @@ def convert_pdf_to_images(pdf_path, output_folder, dpi=300):
         image_paths.append(image_path)
     return image_paths
 
-def ocr_with_gemini(image_paths, instruction):
-    """Perform OCR on images using Gemini model."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise EnvironmentError("GEMINI_API_KEY not found in environment variables.")
-    configure(api_key=api_key)
-    model = GenerativeModel("gemini-2.0-flash")
+async def ocr_with_gemini(image_paths, instruction, priority=PRIORITY_INGEST):
+    """Perform OCR on images using Gemini model, scheduled behind interactive chat."""
     images = [Image.open(path) for path in image_paths]
     prompt = f"""
     {instruction}
@@ -79,30 +88,79 @@ def ocr_with_gemini(image_paths, instruction):
     Do not add any extra formatting or interpretation.
     """
     try:
-        response = model.generate_content([prompt, *images])
+        response = await llm_gateway.generate_content(
+            [prompt, *images], priority=priority, timeout=LLM_OCR_TIMEOUT_SECONDS
+        )
     finally:
         for img in images:
             img.close()
     return response.text
 
-def summarize_and_extract_keywords(text, model):
-    """Summarize Urdu story and extract keywords as a list."""
-    print("[INFO] Generating summary...")
+async def summarize_and_extract_keywords(text, priority=PRIORITY_INGEST):
+    """Summarize Urdu story and extract keywords as a list. Both prompts run concurrently."""
+    print("[INFO] Generating summary and keywords...")
     summary_prompt = f"""
     مندرجہ ذیل اردو کہانی کا خلاصہ اردو میں چند سادہ جملوں میں بیان کریں:\n\n{text}
     """
-    summary_response = model.invoke(summary_prompt)
-    summary = summary_response.content.strip()
-    print(f"[DEBUG] Summary generated (first 1000 chars): {summary[:1000]}")
-    print("[INFO] Extracting keywords...")
     keyword_prompt = f"""
     نیچے دی گئی کہانی سے ۵ سے ۱۰ اہم اردو کلیدی الفاظ (keywords) صرف ایک لائن میں، صرف الفاظ، کوما سے جدا کر کے لکھیں۔ وضاحت نہ دیں:\n\n{text}
     """
-    keyword_response = model.invoke(keyword_prompt)
+    summary_response, keyword_response = await asyncio.gather(
+        llm_gateway.ainvoke(summary_prompt, priority=priority),
+        llm_gateway.ainvoke(keyword_prompt, priority=priority),
+    )
+    summary = summary_response.content.strip()
+    print(f"[DEBUG] Summary generated (first 1000 chars): {summary[:1000]}")
     keywords = [kw.strip() for kw in keyword_response.content.strip().split(',') if kw.strip()]
     print(f"[DEBUG] Keywords extracted: {keywords}")
     return summary, keywords
 
+FAQ_INTENTS = ("main_idea", "characters", "moral", "setting", "other")
+
+def parse_book_faq(raw: str) -> dict:
+    """Parse the FAQ/glossary JSON returned by Gemini, dropping malformed entries."""
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = raw.strip("`")
+        raw = raw[raw.find("{"):]
+    try:
+        data = json.loads(raw[raw.find("{"):raw.rfind("}") + 1])
+    except ValueError as e:
+        print(f"[WARN] Could not parse book FAQ JSON: {e}")
+        return {"faq": [], "glossary": []}
+    faq = [
+        {"intent": item.get("intent") if item.get("intent") in FAQ_INTENTS else "other",
+         "question": str(item["question"]).strip(), "answer": str(item["answer"]).strip()}
+        for item in data.get("faq", []) if isinstance(item, dict) and item.get("question") and item.get("answer")
+    ]
+    glossary = [
+        {"word": str(item["word"]).strip(), "meaning": str(item["meaning"]).strip(),
+         "example": str(item.get("example", "")).strip()}
+        for item in data.get("glossary", []) if isinstance(item, dict) and item.get("word") and item.get("meaning")
+    ]
+    return {"faq": faq, "glossary": glossary}
+
+async def generate_book_faq(text, priority=PRIORITY_INGEST):
+    """
+    One Gemini call at ingestion producing the book's FAQ (main idea,
+    characters, moral, setting and a few common questions) and a glossary of
+    difficult words with meanings and example sentences.
+    """
+    print("[INFO] Generating book FAQ and glossary...")
+    prompt = f"""
+    نیچے دی گئی اردو کہانی پڑھ کر صرف JSON لکھیں، کوئی اور متن نہیں، اس شکل میں:
+    {{"faq": [{{"intent": "...", "question": "...", "answer": "..."}}], "glossary": [{{"word": "...", "meaning": "...", "example": "..."}}]}}
+    - faq میں یہ intent ضرور شامل کریں: main_idea (مرکزی خیال)، characters (کردار)، moral (سبق)، setting (کہانی کہاں اور کب کی ہے)۔ بچوں کے پانچ مزید عام سوالات intent "other" کے ساتھ لکھیں۔
+    - glossary میں کہانی کے ۱۰ سے ۲۰ مشکل الفاظ، ان کا آسان مطلب، اور ایک آسان جملہ جس میں وہ لفظ استعمال ہو۔
+    - تمام جوابات سادہ اردو میں، ۱ سے ۴ سطروں میں ہوں۔
+
+    {text}
+    """
+    response = await llm_gateway.ainvoke(prompt, priority=priority)
+    book_faq = parse_book_faq(response.content)
+    print(f"[INFO] Book FAQ: {len(book_faq['faq'])} answers, {len(book_faq['glossary'])} glossary words")
+    return book_faq
+
 def chunk_extracted_text(text, chunk_size=1000, chunk_overlap=200):
     """Split large Urdu text into overlapping chunks for LLM ingestion."""
     splitter = RecursiveCharacterTextSplitter(
@@ -111,10 +169,14 @@ def chunk_extracted_text(text, chunk_size=1000, chunk_overlap=200):
     )
     return splitter.create_documents([text])
 
-def create_vector_db(collection_name: str, texts: List[str], metadatas: List[Dict]) -> None:
-    """Create a Qdrant vector DB collection and upload documents with payload indexes for filtering."""
-    print("[INFO] Generating embeddings...")
-    vectors = embeddings.embed_documents(texts)
+def create_vector_db(collection_name: str, texts: List[str], metadatas: List[Dict], vectors: List[List[float]] = None) -> None:
+    """
+    Create a Qdrant vector DB collection and upload documents with payload indexes for filtering.
+    Pass ``vectors`` when the texts were already embedded (e.g. by bulk_ingest's worker pool).
+    """
+    if vectors is None:
+        print("[INFO] Generating embeddings...")
+        vectors = get_encoders()[0].embed_documents(texts)
     print("[INFO] Connecting to Qdrant...")
     client = QdrantClient(
         url=os.getenv("QDRANT_URL"),
@@ -170,6 +232,23 @@ def create_vector_db(collection_name: str, texts: List[str], metadatas: List[Dic
     client.upsert(collection_name=collection_name, points=points)
     print(f"[INFO] Successfully uploaded {len(points)} documents to Qdrant.")
 
+_qdrant_client = None
+_async_qdrant_client = None
+
+def get_qdrant_client() -> QdrantClient:
+    """Shared Qdrant client; creating one per query costs a connection setup every time."""
+    global _qdrant_client
+    if _qdrant_client is None:
+        _qdrant_client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    return _qdrant_client
+
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """Shared async Qdrant client used by the chat path."""
+    global _async_qdrant_client
+    if _async_qdrant_client is None:
+        _async_qdrant_client = AsyncQdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    return _async_qdrant_client
+
 def get_retriever(collection_name: str, k: int = 5):
     """Return a semantic retriever backed by Qdrant and HuggingFace embeddings."""
     qdrant_client = QdrantClient(
@@ -179,98 +258,270 @@ def get_retriever(collection_name: str, k: int = 5):
     vectorstore = Qdrant(
         client=qdrant_client,
         collection_name=collection_name,
-        embeddings=embeddings,
+        embeddings=get_encoders()[0],
     )
     retriever = vectorstore.as_retriever(search_kwargs={"k": k})
     return retriever
 
-def hybrid_retrieve(query, collection_name, k=5):
-    """Retrieve documents using both vector similarity and keyword/summary match."""
-    print(f"[DEBUG] hybrid_retrieve called with collection: {collection_name}")
-    print(f"[DEBUG] Query: {query}")
-    
-    qdrant_client = QdrantClient(
-        url=os.getenv("QDRANT_URL"),
-        api_key=os.getenv("QDRANT_API_KEY")
-    )
-    
-    # Check if collection exists
-    try:
-        collections = qdrant_client.get_collections()
-        collection_names = [c.name for c in collections.collections]
-        print(f"[DEBUG] Available collections: {collection_names}")
-        
-        if collection_name not in collection_names:
-            print(f"[ERROR] Collection '{collection_name}' not found!")
-            return []
-            
-    except Exception as e:
-        print(f"[ERROR] Error checking collections: {e}")
-        return []
-    
-    vectorstore = Qdrant(
-        client=qdrant_client,
-        collection_name=collection_name,
-        embeddings=embeddings,
-    )
-    vector_docs = vectorstore.similarity_search(query, k=k)
-    print(f"[DEBUG] Vector search returned {len(vector_docs)} documents")
-    
-    summary_keywords = ["خلاصہ", "مرکزی خیال", "theme", "summary", "main idea", "موضوع"]
-    include_summary = any(word in query for word in summary_keywords)
-    summary_doc = None
-    if include_summary:
-        filter_summary = {"must": [{"key": "type", "match": {"value": "summary"}}]}
-        try:
-            docs = vectorstore.client.scroll(
-                collection_name=collection_name,
-                scroll_filter=filter_summary,
-                limit=1
-            )[0]
-            from langchain_core.documents import Document
-            if docs:
-                summary_doc = Document(page_content=docs[0].payload.get("page_content", ""), metadata=docs[0].payload)
-        except Exception as e:
-            print(f"[WARN] Could not fetch summary chunk: {e}")
-    filter_ = {
-        "should": [
-            {"key": "keywords", "match": {"value": query}},
-            {"key": "summary", "match": {"value": query}},
-        ]
-    }
-    try:
-        payload_docs = vectorstore.client.scroll(
-            collection_name=collection_name,
-            scroll_filter=filter_,
-            limit=k
-        )[0]
-        from langchain_core.documents import Document
-        payload_docs = [Document(page_content=doc.payload.get("page_content", ""), metadata=doc.payload) for doc in payload_docs]
-    except Exception as e:
-        print(f"[WARN] Payload filter search failed: {e}")
-        payload_docs = []
+SUMMARY_QUERY_KEYWORDS = ["خلاصہ", "مرکزی خیال", "theme", "summary", "main idea", "موضوع"]
+
+def _payload_document(point) -> Document:
+    return Document(page_content=point.payload.get("page_content", ""), metadata=point.payload)
+
+def merge_retrieved(summary_doc, payload_docs, vector_docs, k: int):
+    """Summary chunk first, then payload and vector hits, de-duplicated on their opening text."""
     seen = set()
     results = []
-    if summary_doc:
-        key = summary_doc.page_content[:100]
-        if key not in seen:
-            results.append(summary_doc)
-            seen.add(key)
-    for doc in payload_docs + vector_docs:
+    for doc in ([summary_doc] if summary_doc else []) + payload_docs + vector_docs:
         key = doc.page_content[:100]
         if key not in seen:
             results.append(doc)
             seen.add(key)
     return results[:k]
 
+async def ahybrid_retrieve(query, collection_name, k=5, query_vector=None):
+    """
+    Retrieve documents using both vector similarity and keyword/summary match.
+    The independent lookups run concurrently on the shared async client:
+    embedding + vector search, the keyword/summary payload scroll, the
+    summary-chunk scroll and the collection check. Pass ``query_vector`` when
+    the query has already been embedded.
+    """
+    client = get_async_qdrant_client()
+
+    async def vector_search():
+        try:
+            vector = query_vector
+            if vector is None:
+                vector = await timed("embed", embedding_batcher.submit(query))
+            with stage("vector_search"):
+                response = await client.query_points(
+                    collection_name=collection_name, query=vector, limit=k, with_payload=True
+                )
+            return [_payload_document(point) for point in response.points]
+        except Exception as e:
+            print(f"[WARN] Vector search failed: {e}")
+            return []
+
+    async def payload_search():
+        filter_ = {
+            "should": [
+                {"key": "keywords", "match": {"value": query}},
+                {"key": "summary", "match": {"value": query}},
+            ]
+        }
+        try:
+            with stage("payload_search"):
+                points, _ = await client.scroll(collection_name=collection_name, scroll_filter=filter_, limit=k)
+            return [_payload_document(point) for point in points]
+        except Exception as e:
+            print(f"[WARN] Payload filter search failed: {e}")
+            return []
+
+    async def summary_lookup():
+        if not any(word in query for word in SUMMARY_QUERY_KEYWORDS):
+            return None
+        filter_summary = {"must": [{"key": "type", "match": {"value": "summary"}}]}
+        try:
+            with stage("summary_lookup"):
+                points, _ = await client.scroll(collection_name=collection_name, scroll_filter=filter_summary, limit=1)
+            return _payload_document(points[0]) if points else None
+        except Exception as e:
+            print(f"[WARN] Could not fetch summary chunk: {e}")
+            return None
+
+    exists, vector_docs, payload_docs, summary_doc = await asyncio.gather(
+        client.collection_exists(collection_name), vector_search(), payload_search(), summary_lookup(),
+        return_exceptions=True,
+    )
+    if exists is not True:
+        print(f"[ERROR] Collection '{collection_name}' not found or unreachable: {exists}")
+        return []
+    print(f"[DEBUG] Vector search returned {len(vector_docs)} documents")
+    return merge_retrieved(summary_doc, payload_docs, vector_docs, k)
+
+def _book_title(doc: Document, collection_name: str) -> str:
+    source = doc.metadata.get("source_pdf")
+    if source:
+        return os.path.splitext(source)[0]
+    parts = collection_name.rsplit("-", 1)
+    return parts[0] if len(parts) > 1 else collection_name
+
+async def library_retrieve(query, collection_names, k=5, query_vector=None):
+    """
+    Search every collection in ``collection_names`` concurrently with one
+    query embedding. Each search has LIBRARY_COLLECTION_TIMEOUT_MS and the
+    fan-out as a whole LIBRARY_BUDGET_MS; slow books are skipped rather than
+    delaying the answer, so latency stays flat as the library grows.
+    Hits are merged on cosine score (comparable across books: same model and
+    metric) and min-max normalized over the merged set into
+    metadata["normalized_score"]; each chunk is labelled with its book title.
+    """
+    if not collection_names:
+        return []
+    if query_vector is None:
+        query_vector = await timed("embed", embedding_batcher.submit(query))
+    client = get_async_qdrant_client()
+    semaphore = asyncio.Semaphore(LIBRARY_MAX_PARALLEL)
+
+    async def search(name):
+        async with semaphore:
+            response = await asyncio.wait_for(
+                client.query_points(collection_name=name, query=query_vector,
+                                    limit=LIBRARY_PER_COLLECTION_K, with_payload=True),
+                LIBRARY_COLLECTION_TIMEOUT_MS / 1000,
+            )
+        return name, response.points
+
+    tasks = [asyncio.create_task(search(name)) for name in collection_names]
+    with stage("library_search"):
+        done, pending = await asyncio.wait(tasks, timeout=LIBRARY_BUDGET_MS / 1000)
+    for task in pending:
+        task.cancel()
+    hits, skipped = [], len(pending)
+    for task in done:
+        if task.exception() is not None:
+            skipped += 1
+            continue
+        name, points = task.result()
+        hits.extend((name, point) for point in points)
+    library_fanout_histogram.observe(len(collection_names))
+    if skipped:
+        library_skipped_counter.inc(skipped)
+        print(f"[WARN] Library search skipped {skipped}/{len(collection_names)} collections (timeout or error)")
+    if not hits:
+        return []
+
+    low = min(point.score for _, point in hits)
+    high = max(point.score for _, point in hits)
+    results, seen = [], set()
+    for name, point in sorted(hits, key=lambda hit: hit[1].score, reverse=True):
+        doc = _payload_document(point)
+        key = doc.page_content[:100]
+        if key in seen:
+            continue
+        seen.add(key)
+        title = _book_title(doc, name)
+        results.append(Document(
+            page_content=f"(کتاب: {title})\n{doc.page_content}",
+            metadata={**doc.metadata, "collection_name": name, "book_title": title, "score": point.score,
+                      "normalized_score": (point.score - low) / (high - low) if high > low else 1.0},
+        ))
+        if len(results) >= k:
+            break
+    return results
+
 class MessagesState(TypedDict):
-    """State for LangGraph workflow, holds chat messages."""
-    messages: list[BaseMessage]
+    """
+    State for LangGraph workflow, holds chat messages. The add_messages reducer
+    appends node/input messages to the checkpointed history, so callers only
+    pass the new question and nodes only return the new answer.
+    """
+    messages: Annotated[list[BaseMessage], add_messages]
+    conversation_summary: str
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local token estimate used for prompt budgeting (Gemini's tokenizer needs an
+    API round trip). Billed counts come from the response's usage_metadata.
+    """
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN) if text else 0
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    return text[:int(tokens * PROMPT_CHARS_PER_TOKEN)]
 
-def create_rag_node(collection_name: str):
-    """Create a RAG node function that uses the specified collection name."""
-    async def rag_node(state: MessagesState) -> dict:
+def assemble_prompt(question: str, context_docs: list, history_summary: str, recent_messages: list, budget: int = None):
+    """
+    Fill qa_template within ``budget`` estimated tokens. The instructions and
+    the question are always kept. When over budget, recent messages are dropped
+    oldest first, then the history summary is cut, and only then are the
+    lowest-ranked context chunks dropped (the top chunk is truncated, never dropped).
+    Returns (prompt, {section: estimated tokens}).
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    instructions = estimate_tokens(qa_template.format(context="", question="", history_summary="", recent_history=""))
+    question_tokens = estimate_tokens(question)
+    contexts = [doc.page_content for doc in context_docs]
+    context_tokens = [estimate_tokens(text) for text in contexts]
+    history_lines = [f"{msg.type.capitalize()}: {msg.content}" for msg in recent_messages]
+    history_tokens = [estimate_tokens(line) + 1 for line in history_lines]
+    summary_tokens = estimate_tokens(history_summary)
+
+    over = instructions + question_tokens + sum(context_tokens) + sum(history_tokens) + summary_tokens - budget
+    while over > 0 and history_lines:
+        history_lines.pop(0)
+        over -= history_tokens.pop(0)
+    if over > 0 and summary_tokens:
+        keep = max(0, summary_tokens - over)
+        history_summary = _truncate_to_tokens(history_summary, keep)
+        over -= summary_tokens - keep
+        summary_tokens = keep
+    while over > 0 and len(contexts) > 1:
+        contexts.pop()
+        over -= context_tokens.pop()
+    if over > 0 and contexts:
+        keep = max(0, context_tokens[0] - over)
+        contexts[0] = _truncate_to_tokens(contexts[0], keep)
+        context_tokens[0] = keep
+
+    sections = {
+        "instructions": instructions,
+        "question": question_tokens,
+        "context": sum(context_tokens),
+        "recent_history": sum(history_tokens),
+        "history_summary": summary_tokens,
+    }
+    prompt = qa_template.invoke({
+        "context": "\n\n".join(contexts),
+        "question": question,
+        "history_summary": history_summary,
+        "recent_history": "\n".join(history_lines),
+    })
+    for section, tokens in sections.items():
+        prompt_section_histogram.observe(tokens, section=section)
+    return prompt, sections
+
+def normalize_query(query: str) -> str:
+    """Unicode-normalize, case-fold and collapse whitespace so trivially different copies match."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip().casefold()
+
+def answer_cache_key(collection_name: str, query: str, history_summary: str = "", history: list = ()) -> str:
+    """Key on the collection, the normalized question and a hash of the history the prompt will see."""
+    history_hash = hashlib.sha256(
+        json.dumps([history_summary, [f"{msg.type}:{msg.content}" for msg in history]], ensure_ascii=False).encode()
+    ).hexdigest()
+    raw = json.dumps([collection_name, normalize_query(query), history_hash], ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def create_rag_node(collection_name: str = None, response_cache=None, usage_recorder=None, faq_lookup=None,
+                    library_collections=None):
+    """
+    Create a RAG node function. The collection is read from
+    config["configurable"]["collection_name"] so one compiled graph can serve
+    every collection; ``collection_name`` is the fallback when it is absent.
+    With a ``response_cache`` (an object with ``get_or_compute(key, compute,
+    cache_if)``), identical questions over identical history are answered once.
+    ``usage_recorder(record)`` is called with the token usage of every Gemini
+    answer; the user comes from config["configurable"]["user_email"].
+    ``await faq_lookup(collection_name, question)`` may return a precomputed
+    FAQ/glossary answer, which is served without retrieval or an LLM call.
+    When config["configurable"]["library"] is set, ``await
+    library_collections(user_email)`` lists the collections to search together.
+    """
+    default_collection_name = collection_name
+
+    async def rag_node(state: MessagesState, config: RunnableConfig) -> dict:
         """LangGraph node for RAG: reranks, summarizes, and generates answer."""
+        configurable = config.get("configurable") or {}
+        collection_name = configurable.get("collection_name", default_collection_name)
+        # Hedged Gemini calls, and retrying a failed call on the fallback model,
+        # are only safe when tokens are not being streamed to a client
+        hedge = bool(configurable.get("hedge"))
+        library_names = None
+        if configurable.get("library") and library_collections is not None:
+            library_names = await library_collections(configurable.get("user_email"))
+            # Cache answers per library contents, not per book
+            collection_name = "library:" + hashlib.sha256("\n".join(library_names).encode()).hexdigest()[:16]
         # Find the last user message (not AI message)
         user_message = None
         user_message_index = -1
@@ -282,16 +533,28 @@ def create_rag_node(collection_name: str):
         
         if not user_message:
             print(f"[ERROR] No user message found in state")
-            return {"messages": state["messages"] + [AIMessage(content="عذر خواہ ہوں، کوئی سوال نہیں ملا۔")]}
+            return {"messages": [AIMessage(content="عذر خواہ ہوں، کوئی سوال نہیں ملا۔")]}
         
         # Only process if this is the most recent user message
         if user_message_index != len(state["messages"]) - 1:
             print(f"[DEBUG] User message is not the most recent, skipping processing")
-            return {"messages": state["messages"]}
+            return {"messages": []}
+        
+        # Non-Urdu, empty or garbage questions get their refusal without retrieval or an LLM call
+        refusal = gate_query(user_message)
+        if refusal:
+            print(f"[DEBUG] Language gate refused the question")
+            return {"messages": [AIMessage(content=refusal)]}
+        
+        if faq_lookup is not None and library_names is None:
+            with stage("faq_lookup"):
+                faq_answer = await faq_lookup(collection_name, user_message)
+            if faq_answer:
+                print(f"[DEBUG] Answered from the book FAQ")
+                return {"messages": [AIMessage(content=faq_answer)]}
         
         summarized_history = state.get("conversation_summary", "")
         last_7_messages = state["messages"][-7:]
-        last_7_text = "\n".join([f"{msg.type.capitalize()}: {msg.content}" for msg in last_7_messages])
         
         print(f"[DEBUG] RAG node using collection: {collection_name}")
         print(f"[DEBUG] User message: {user_message}")
@@ -299,42 +562,296 @@ def create_rag_node(collection_name: str):
         print(f"[DEBUG] Message types: {[msg.type for msg in state['messages']]}")
         print(f"[DEBUG] User message index: {user_message_index}")
         
-        # Get documents from the correct collection
-        docs = hybrid_retrieve(user_message, collection_name, k=5)
-        print(f"[DEBUG] Retrieved {len(docs)} documents from collection {collection_name}")
-        
-        if not docs:
-            print(f"[WARNING] No documents found in collection {collection_name}")
-            # Return a message indicating no context found
-            return {"messages": state["messages"] + [AIMessage(content="عذر خواہ ہوں، اس PDF سے متعلق معلومات دستیاب نہیں ہیں۔ براہ کرم یقینی بنائیں کہ PDF اپلوڈ کی گئی ہے۔")]}
+        async def answer():
+            """Retrieve, rerank and generate. Returns (message, cacheable)."""
+            # Get documents from the correct collection; embedding overlaps the payload lookups
+            with stage("retrieve"):
+                if library_names is not None:
+                    docs = await library_retrieve(user_message, library_names, k=5)
+                else:
+                    docs = await ahybrid_retrieve(user_message, collection_name, k=5)
+            print(f"[DEBUG] Retrieved {len(docs)} documents from collection {collection_name}")
         
-        doc_texts = [doc.page_content for doc in docs]
-        query_emb = reranker_model.encode(user_message, convert_to_tensor=True)
-        doc_embs = reranker_model.encode(doc_texts, convert_to_tensor=True)
-        cos_scores = util.cos_sim(query_emb, doc_embs)[0]
-        top_k = torch.topk(cos_scores, k=min(3, len(docs)))
-        reranked_docs = [docs[i] for i in top_k.indices]
-        context_text = "\n\n".join([doc.page_content for doc in reranked_docs])
+            if not docs:
+                print(f"[WARNING] No documents found in collection {collection_name}")
+                # Return a message indicating no context found
+                return AIMessage(content=NO_CONTEXT_ANSWER), False
         
-        print(f"[DEBUG] Context length: {len(context_text)} characters")
-        print(f"[DEBUG] Context preview: {context_text[:200]}...")
+            doc_texts = [doc.page_content for doc in docs]
+            with stage("rerank"):
+                query_emb, *doc_embs = await reranker_batcher.submit_many([user_message] + doc_texts)
+                cos_scores = util.cos_sim(query_emb, torch.stack(doc_embs))[0]
+                top_k = torch.topk(cos_scores, k=min(3, len(docs)))
+            reranked_docs = [docs[i] for i in top_k.indices]
         
-        rag_input = {
-            "context": context_text,
-            "question": user_message,
-            "history_summary": summarized_history,
-            "recent_history": last_7_text
-        }
-        full_prompt = qa_template.invoke(rag_input)
-        result = await model.ainvoke(full_prompt)
-        print("📘 جواب:", result.content)
-        return {"messages": state["messages"] + [AIMessage(content=result.content)]}
+            full_prompt, sections = assemble_prompt(user_message, reranked_docs, summarized_history, last_7_messages)
+            print(f"[DEBUG] Prompt sections (estimated tokens): {sections}")
+            with stage("generate"):
+                result = await llm_gateway.ainvoke(full_prompt, priority=PRIORITY_CHAT, hedge=hedge, retry=hedge)
+            usage = getattr(result, "usage_metadata", None) or {}
+            llm_tokens_counter.inc(usage.get("input_tokens", 0), direction="input")
+            llm_tokens_counter.inc(usage.get("output_tokens", 0), direction="output")
+            if usage_recorder is not None:
+                usage_recorder({
+                    "session_id": configurable.get("thread_id"),
+                    "user_email": configurable.get("user_email"),
+                    "collection_name": collection_name,
+                    "model": (getattr(result, "response_metadata", None) or {}).get("model_name"),
+                    "input_tokens": usage.get("input_tokens", 0),
+                    "output_tokens": usage.get("output_tokens", 0),
+                    "estimated_prompt_tokens": sum(sections.values()),
+                    "prompt_sections": sections,
+                })
+            print("📘 جواب:", result.content)
+            return result, True
+
+        if response_cache is None:
+            message, _ = await answer()
+            # Keep the model's own message (and id) so streamed chunks and the
+            # stored message line up when the graph runs in "messages" stream mode.
+            return {"messages": [message]}
+
+        produced = []
+
+        async def compute():
+            message, cacheable = await answer()
+            produced.append((message, cacheable))
+            return message.content
+
+        # The prompt sees the summary and the messages before this question
+        key = answer_cache_key(collection_name, user_message, summarized_history, last_7_messages[:-1])
+        content = await response_cache.get_or_compute(key, compute, cache_if=lambda _: produced[0][1])
+        if produced:
+            return {"messages": [produced[0][0]]}
+        # Served from the cache or by a concurrent identical request
+        return {"messages": [AIMessage(content=content)]}
     return rag_node
 
-def create_workflow(collection_name: str):
-    """Create a LangGraph workflow for the specified collection."""
+NO_CONTEXT_ANSWER = "عذر خواہ ہوں، اس PDF سے متعلق معلومات دستیاب نہیں ہیں۔ براہ کرم یقینی بنائیں کہ PDF اپلوڈ کی گئی ہے۔"
+
+# --- BATCH QUESTIONS (worksheets) ---
+BATCH_INSTRUCTIONS = """
+آپ ایک ماہر اردو زبان کے تجزیہ کار ہیں جو بچوں کی کہانیوں کے ساتھ کام کرتے ہیں۔ نیچے کہانی کے چند حصے اور کئی سوالات دیے گئے ہیں۔
+- ہر سوال کا جواب اس کے ساتھ درج حصوں کی بنیاد پر، مکمل اردو میں، ۱ سے ۴ سطروں میں دیں۔
+- اگر کسی لفظ کا مطلب پوچھا جائے تو پہلے آسان مطلب بتائیں، پھر اسے ایک آسان جملے میں استعمال کریں۔
+- اگر معلومات دستیاب نہ ہوں تو لکھیں: "اس کی تفصیل دستیاب نہیں ہے"
+- صرف JSON لکھیں، کوئی اور متن نہیں: {"answers": [{"id": 1, "answer": "..."}]}
+"""
+
+async def retrieve_batch(questions: list, collection_name: str, k: int = 5) -> list:
+    """Embed every question in one forward pass and search Qdrant with one batched request."""
+    with stage("embed"):
+        vectors = await embedding_batcher.submit_many(questions)
+    with stage("vector_search"):
+        responses = await get_async_qdrant_client().query_batch_points(
+            collection_name=collection_name,
+            requests=[QueryRequest(query=vector, limit=k, with_payload=True) for vector in vectors],
+        )
+    return [[_payload_document(point) for point in response.points] for response in responses]
+
+async def rerank_batch(questions: list, docs_per_question: list, top_n: int = 3) -> list:
+    """Rerank every question's hits with one reranker call; shared chunks are encoded once."""
+    unique_texts = list(dict.fromkeys(doc.page_content for docs in docs_per_question for doc in docs))
+    if not unique_texts:
+        return [[] for _ in questions]
+    with stage("rerank"):
+        encoded = await reranker_batcher.submit_many(list(questions) + unique_texts)
+    question_embs = encoded[:len(questions)]
+    text_embs = dict(zip(unique_texts, encoded[len(questions):]))
+    reranked = []
+    for question_emb, docs in zip(question_embs, docs_per_question):
+        if not docs:
+            reranked.append([])
+            continue
+        scores = util.cos_sim(question_emb, torch.stack([text_embs[doc.page_content] for doc in docs]))[0]
+        top_k = torch.topk(scores, k=min(top_n, len(docs)))
+        reranked.append([docs[i] for i in top_k.indices])
+    return reranked
+
+def pack_questions(items: list, budget: int = None, max_per_call: int = None) -> list:
+    """
+    Greedily group (id, question, docs) items into packed prompts of at most
+    ``budget`` estimated tokens and ``max_per_call`` questions. Chunks shared by
+    questions in a group are counted (and sent) once.
+    """
+    budget = budget or BATCH_PROMPT_TOKEN_BUDGET
+    max_per_call = max_per_call or BATCH_MAX_QUESTIONS_PER_CALL
+    base = estimate_tokens(BATCH_INSTRUCTIONS)
+    groups, current, seen, tokens = [], [], set(), base
+    for item in items:
+        _, question, docs = item
+        def cost(known):
+            new_chunks = {doc.page_content for doc in docs} - known
+            return estimate_tokens(question) + 10 + sum(estimate_tokens(text) for text in new_chunks)
+        if current and (tokens + cost(seen) > budget or len(current) >= max_per_call):
+            groups.append(current)
+            current, seen, tokens = [], set(), base
+        tokens += cost(seen)
+        seen.update(doc.page_content for doc in docs)
+        current.append(item)
+    if current:
+        groups.append(current)
+    return groups
+
+def build_packed_prompt(group: list) -> str:
+    chunk_ids = {}
+    for _, _, docs in group:
+        for doc in docs:
+            chunk_ids.setdefault(doc.page_content, len(chunk_ids) + 1)
+    chunks = "\n\n".join(f"[{number}] {text}" for text, number in chunk_ids.items())
+    questions = "\n".join(
+        f"{question_id}. (حصے: {', '.join(str(chunk_ids[doc.page_content]) for doc in docs)}) {question}"
+        for question_id, question, docs in group
+    )
+    return f"{BATCH_INSTRUCTIONS}\n**کہانی کے حصے:**\n{chunks}\n\n**سوالات:**\n{questions}\n"
+
+def parse_packed_answers(raw: str) -> dict:
+    """{question id: answer} from a packed call's JSON; malformed output yields {}."""
+    raw = raw.strip()
+    try:
+        data = json.loads(raw[raw.find("{"):raw.rfind("}") + 1])
+        return {int(item["id"]): str(item["answer"]).strip() for item in data.get("answers", [])
+                if isinstance(item, dict) and item.get("answer")}
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"[WARN] Could not parse packed answers: {e}")
+        return {}
+
+async def _answer_packed_group(group: list, collection_name: str, usage_recorder=None, user_email: str = None) -> list:
+    """One LLM call for a packed group; questions missing from its output are answered singly."""
+    response = await llm_gateway.ainvoke(build_packed_prompt(group), priority=PRIORITY_BACKGROUND)
+    responses = [response]
+    answers = parse_packed_answers(response.content)
+    for question_id, question, docs in group:
+        if question_id not in answers:
+            prompt, _ = assemble_prompt(question, docs, "", [])
+            single = await llm_gateway.ainvoke(prompt, priority=PRIORITY_BACKGROUND)
+            responses.append(single)
+            answers[question_id] = single.content
+    for result in responses:
+        usage = getattr(result, "usage_metadata", None) or {}
+        llm_tokens_counter.inc(usage.get("input_tokens", 0), direction="input")
+        llm_tokens_counter.inc(usage.get("output_tokens", 0), direction="output")
+        if usage_recorder is not None:
+            usage_recorder({
+                "session_id": None,
+                "user_email": user_email,
+                "collection_name": collection_name,
+                "model": (getattr(result, "response_metadata", None) or {}).get("model_name"),
+                "input_tokens": usage.get("input_tokens", 0),
+                "output_tokens": usage.get("output_tokens", 0),
+                "batch_questions": len(group),
+            })
+    return [(question_id, answers[question_id]) for question_id, _, _ in group]
+
+async def answer_questions(questions: list, collection_name: str, faq_lookup=None, usage_recorder=None, user_email: str = None):
+    """
+    Answer a worksheet of independent questions about one collection. Yields
+    (index, answer, source) as answers complete; source is "language_gate",
+    "faq", "no_context" or "llm". Repeated questions are answered once.
+    """
+    pending = {}
+    for index, question in enumerate(questions):
+        refusal = gate_query(question)
+        if refusal:
+            yield index, refusal, "language_gate"
+            continue
+        if faq_lookup is not None:
+            faq_answer = await faq_lookup(collection_name, question)
+            if faq_answer:
+                yield index, faq_answer, "faq"
+                continue
+        pending.setdefault(normalize_query(question), []).append(index)
+    if not pending:
+        return
+
+    unique = [(indices, questions[indices[0]]) for indices in pending.values()]
+    unique_questions = [question for _, question in unique]
+    with stage("retrieve"):
+        docs_per_question = await retrieve_batch(unique_questions, collection_name)
+    reranked = await rerank_batch(unique_questions, docs_per_question)
+
+    items = []
+    for question_id, ((indices, question), docs) in enumerate(zip(unique, reranked), start=1):
+        if not docs:
+            for index in indices:
+                yield index, NO_CONTEXT_ANSWER, "no_context"
+            continue
+        items.append((question_id, question, docs))
+    indices_by_id = {question_id: unique[question_id - 1][0] for question_id, _, _ in items}
+
+    groups = pack_questions(items)
+    print(f"[INFO] Batch of {len(questions)} questions: {len(items)} to the LLM in {len(groups)} call(s)")
+    tasks = [asyncio.create_task(_answer_packed_group(group, collection_name, usage_recorder, user_email))
+             for group in groups]
+    try:
+        for next_group in asyncio.as_completed(tasks):
+            for question_id, answer in await next_group:
+                for index in indices_by_id[question_id]:
+                    yield index, answer, "llm"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def summarize_history(messages, previous_summary: str = "", llm=None) -> str:
+    """Fold older messages into the rolling conversation summary."""
+    history_text = "\n".join([f"{msg.type.capitalize()}: {msg.content}" for msg in messages])
+    summary_prompt = f"Summarize the following conversation history:\n{history_text}\nPrevious summary (if any): {previous_summary}"
+    if llm is not None:
+        summary_response = await llm.ainvoke(summary_prompt)
+    else:
+        summary_response = await llm_gateway.ainvoke(summary_prompt, priority=PRIORITY_BACKGROUND)
+    return summary_response.content.strip()
+
+async def compact_history(app, config, keep: int = None, compact_after: int = None, lock=None) -> bool:
+    """
+    Bound a thread's checkpointed state: once it holds more than
+    ``compact_after`` messages, everything but the last ``keep`` is folded into
+    ``conversation_summary`` and removed. Returns True if the thread was compacted.
+
+    The summary is written without holding ``lock`` (an async context manager
+    factory); only the state update takes it. Messages are removed by id, so
+    turns added meanwhile are kept; if another compaction got there first the
+    update is skipped.
+    """
+    keep = HISTORY_KEEP_MESSAGES if keep is None else keep
+    compact_after = HISTORY_COMPACT_AFTER if compact_after is None else compact_after
+    snapshot = await app.aget_state(config)
+    messages = snapshot.values.get("messages", [])
+    if len(messages) <= compact_after:
+        return False
+    old_messages = [msg for msg in messages[:-keep] if msg.id]
+    if not old_messages:
+        return False
+    previous_summary = snapshot.values.get("conversation_summary", "")
+    summary = await summarize_history(old_messages, previous_summary)
+    async with (lock() if lock is not None else contextlib.nullcontext()):
+        current = (await app.aget_state(config)).values
+        current_ids = {msg.id for msg in current.get("messages", [])}
+        if current.get("conversation_summary", "") != previous_summary or \
+                any(msg.id not in current_ids for msg in old_messages):
+            return False
+        await app.aupdate_state(
+            config,
+            {
+                "messages": [RemoveMessage(id=msg.id) for msg in old_messages],
+                "conversation_summary": summary,
+            },
+            as_node="rag",
+        )
+    print(f"[INFO] Compacted {len(old_messages)} messages into the conversation summary")
+    return True
+
+def create_workflow(collection_name: str = None, response_cache=None, usage_recorder=None, faq_lookup=None,
+                    library_collections=None):
+    """
+    Create a LangGraph workflow. Without a collection_name the graph expects
+    config["configurable"]["collection_name"] on every invocation.
+    """
     workflow = StateGraph(MessagesState)
-    rag_node_func = create_rag_node(collection_name)
+    rag_node_func = create_rag_node(
+        collection_name, response_cache=response_cache, usage_recorder=usage_recorder, faq_lookup=faq_lookup,
+        library_collections=library_collections,
+    )
     workflow.add_node("rag", rag_node_func)
     workflow.set_entry_point("rag")
     workflow.add_edge("rag", END)
@@ -391,11 +908,116 @@ qa_template = PromptTemplate(
 """
 )
 
+def load_encoders():
+    """
+    Return the (embeddings, reranker) pair. When MODEL_SERVER_SOCKET is set the
+    models live in the shared model server process (see model_server.py) and
+    this worker only holds thin clients; otherwise they are loaded in-process.
+    """
+    socket_path = os.getenv("MODEL_SERVER_SOCKET")
+    if socket_path:
+        print(f"[INFO] Using shared model server at {socket_path}")
+        client = ModelClient(socket_path)
+        return RemoteEmbeddings(client), RemoteSentenceEncoder(client)
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME), SentenceTransformer(RERANKER_MODEL_NAME)
+
+_encoders = None
+_encoders_lock = threading.Lock()
+
+def get_encoders():
+    """
+    The shared (embeddings, reranker) pair, loaded on first use so tools that
+    only need the ingestion helpers (bulk_ingest) never load the models. The
+    API loads them at startup (see init_chat_graph).
+    """
+    global _encoders
+    with _encoders_lock:
+        if _encoders is None:
+            _encoders = load_encoders()
+    return _encoders
+
+# --- LLM GATEWAY ---
+# Every Gemini call goes through one scheduler: chat before background
+# summaries before ingestion, adaptive concurrency, timeouts, optional
+# hedging and a lighter fallback model under pressure (see llm_gateway.py).
+LLM_OCR_TIMEOUT_SECONDS = float(os.getenv("LLM_OCR_TIMEOUT_SECONDS", "300"))
+llm_gateway = LLMGateway(
+    "gemini-2.0-flash",
+    fallback_model_name=os.getenv("GEMINI_FALLBACK_MODEL", "gemini-2.0-flash-lite") or None,
+    api_key=os.getenv("GEMINI_API_KEY"),
+    initial_concurrency=int(os.getenv("LLM_INITIAL_CONCURRENCY", "4")),
+    min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+    latency_slo=float(os.getenv("LLM_CHAT_LATENCY_SLO_SECONDS", "8")),
+    hedge_after=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "6")),
+)
+
+# --- OCR ENGINES ---
+# OCR_POLICY: gemini | local | local-first | gemini-first (see ocr_engines.py).
+# The local engine is Tesseract's "urd" model in a process pool.
+ocr_router = OCRRouter(
+    gemini=GeminiEngine(ocr_with_gemini, pages_per_call=int(os.getenv("OCR_GEMINI_PAGES_PER_CALL", "10"))),
+    local=TesseractEngine(
+        lang=os.getenv("OCR_TESSERACT_LANG", "urd"),
+        workers=int(os.getenv("OCR_LOCAL_WORKERS", "0")) or None,
+    ),
+    policy=os.getenv("OCR_POLICY", "gemini"),
+    min_confidence=float(os.getenv("OCR_MIN_CONFIDENCE", "0.75")),
+)
+
 model=load_model()
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/distiluse-base-multilingual-cased-v2")
 collection_name="unnamed"
 prompt = qa_template
-reranker_model = SentenceTransformer("distiluse-base-multilingual-cased-v2")
+
+# Prompts are assembled within PROMPT_TOKEN_BUDGET estimated tokens
+# (see assemble_prompt); ~3 characters per token suits Urdu text.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3"))
+prompt_section_histogram = histogram(
+    "prompt_section_tokens", "Estimated tokens per prompt section after budgeting",
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+# Library mode fans one question out to every collection a user owns
+LIBRARY_PER_COLLECTION_K = int(os.getenv("LIBRARY_PER_COLLECTION_K", "3"))
+LIBRARY_COLLECTION_TIMEOUT_MS = float(os.getenv("LIBRARY_COLLECTION_TIMEOUT_MS", "400"))
+LIBRARY_BUDGET_MS = float(os.getenv("LIBRARY_BUDGET_MS", "800"))
+LIBRARY_MAX_PARALLEL = int(os.getenv("LIBRARY_MAX_PARALLEL", "32"))
+library_fanout_histogram = histogram(
+    "library_search_collections", "Collections searched per library question", buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+library_skipped_counter = counter("library_search_skipped_total", "Collections dropped from a library search by timeout or error")
+
+# Worksheet batches pack several questions into one Gemini call
+BATCH_PROMPT_TOKEN_BUDGET = int(os.getenv("BATCH_PROMPT_TOKEN_BUDGET", "12000"))
+BATCH_MAX_QUESTIONS_PER_CALL = int(os.getenv("BATCH_MAX_QUESTIONS_PER_CALL", "10"))
+llm_tokens_counter = counter("llm_chat_tokens_total", "Gemini tokens billed for chat answers, by direction")
+
+# Conversation state is compacted to the last HISTORY_KEEP_MESSAGES messages
+# plus a rolling summary once it grows past HISTORY_COMPACT_AFTER messages.
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", "8"))
+HISTORY_COMPACT_AFTER = int(os.getenv("HISTORY_COMPACT_AFTER", "16"))
+
+# --- MICRO-BATCHERS ---
+# Concurrent chat requests embed a single query each; the batchers coalesce
+# them into one forward pass per few milliseconds (or per N items).
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+RERANK_BATCH_MAX_SIZE = int(os.getenv("RERANK_BATCH_MAX_SIZE", "64"))
+RERANK_BATCH_MAX_WAIT_MS = float(os.getenv("RERANK_BATCH_MAX_WAIT_MS", "5"))
+
+embedding_batcher = MicroBatcher(
+    lambda texts: get_encoders()[0].embed_documents(texts),
+    name="embedding",
+    max_batch_size=EMBED_BATCH_MAX_SIZE,
+    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+)
+reranker_batcher = MicroBatcher(
+    lambda texts: list(get_encoders()[1].encode(texts, convert_to_tensor=True)),
+    name="reranker",
+    max_batch_size=RERANK_BATCH_MAX_SIZE,
+    max_wait_ms=RERANK_BATCH_MAX_WAIT_MS,
+)
 
 
 # --- GRAPH/MEMORY/WORKFLOW SETUP ---
@@ -412,8 +1034,8 @@ async def main():
     with tempfile.TemporaryDirectory() as temp_dir:
         print(f"[INFO] Using temp directory: {temp_dir}")
         image_files = convert_pdf_to_images(pdf_file, temp_dir)
-        extracted_text = ocr_with_gemini(image_files, ocr_instruction)
-        summary, keywords = summarize_and_extract_keywords(extracted_text, model)
+        extracted_text, ocr_report = await ocr_router.extract_text(image_files, ocr_instruction)
+        summary, keywords = await summarize_and_extract_keywords(extracted_text)
         text_chunks = chunk_extracted_text(extracted_text)
         for i, doc in enumerate(text_chunks):
             doc.metadata = {
@@ -461,7 +1083,6 @@ async def main():
 
         async def interactive_chat():
             thread_id = str(uuid.uuid4())
-            state = {"messages": [], "conversation_summary": ""}
             config = {"configurable": {"thread_id": thread_id}}
             while True:
                 query = input("📝 سوال کریں: ")
@@ -470,15 +1091,9 @@ async def main():
                     break
                 if not query.strip():
                     continue 
-                state["messages"].append(HumanMessage(content=query))
-                if len(state["messages"]) > 7:
-                    old_messages = state["messages"][:-10]
-                    history_text = "\n".join([f"{msg.type.capitalize()}: {msg.content}" for msg in old_messages])
-                    summary_prompt = f"Summarize the following conversation history:\n{history_text}\nPrevious summary (if any): {state.get('conversation_summary', '')}"
-                    summary_response = await model.ainvoke(summary_prompt)
-                    state["conversation_summary"] = summary_response.content.strip()
-                    state["messages"] = state["messages"][-7:]
-                state = await app.ainvoke(state, config)
+                # The checkpointer already holds the history; only send the new question.
+                await app.ainvoke({"messages": [HumanMessage(content=query)]}, config)
+                await compact_history(app, config)
         await interactive_chat()
 
 if __name__ == "__main__":
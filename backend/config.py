@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings 
 from dotenv import load_dotenv
 
@@ -16,6 +17,10 @@ class Settings(BaseSettings):
     MAIL_USERNAME: str
     MAIL_PASSWORD: str
     MAIL_SSL_TLS: bool = True
+    MAIL_STARTTLS: bool = False
+    MAIL_SERVER: str = "smtp.gmail.com"
+    MAIL_PORT: int = 465
+    MAIL_USE_CREDENTIALS: bool = True
     FASTAPI_SECRET_KEY: str
     
     # ADDED: RAG and AI service environment variables
@@ -25,6 +30,67 @@ class Settings(BaseSettings):
     GOOGLE_APPLICATION_CREDENTIALS: str
     HF_HOME: str
 
+    # Checkpoint retention for LangGraph chat threads
+    CHECKPOINT_KEEP: int = 5
+    CHECKPOINT_HIDDEN_TTL_DAYS: int = 7
+    CHECKPOINT_COMPACTION_INTERVAL_MINUTES: int = 30
+    # Cross-worker chat thread lock (Redis only): auto-release after a crash, max wait
+    THREAD_LOCK_TTL_SECONDS: int = 300
+    THREAD_LOCK_WAIT_SECONDS: int = 120
+
+    # Request logging pipeline
+    LOG_QUEUE_MAXSIZE: int = 10000
+    LOG_BATCH_SIZE: int = 500
+    LOG_FLUSH_INTERVAL_SECONDS: float = 2.0
+
+    # Optional shared Redis (caches, rate limits); in-process fallbacks when unset
+    REDIS_URL: Optional[str] = None
+
+    # Authenticated-user cache
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAXSIZE: int = 10000
+
+    # Password hashing
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+
+    # Per-user quotas on the expensive endpoints (token bucket + concurrency cap)
+    CHAT_RATE_PER_MINUTE: float = 20
+    CHAT_BURST: int = 5
+    CHAT_MAX_CONCURRENT: int = 2
+    INGEST_RATE_PER_MINUTE: float = 0.2
+    INGEST_BURST: int = 3
+    INGEST_MAX_CONCURRENT: int = 1
+
+    # /api/chat/batch (worksheets): each call counts once against this quota
+    BATCH_MAX_QUESTIONS: int = 30
+    BATCH_RATE_PER_MINUTE: float = 2
+    BATCH_BURST: int = 3
+    BATCH_MAX_CONCURRENT: int = 1
+
+    # Exact-match answer cache and /api/chat idempotency keys
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    RESPONSE_CACHE_MAXSIZE: int = 2048
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+
+    # Generate a FAQ + glossary per book at upload and answer matching questions from it
+    BOOK_FAQ_ENABLED: bool = True
+
+    # Comma-separated emails allowed to see usage across all users (/api/admin/usage)
+    ADMIN_EMAILS: str = ""
+
+    # PDF upload limits, checked before OCR starts
+    MAX_UPLOAD_MB: int = 50
+    MAX_PDF_PAGES: int = 100
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+
+    # Email outbox delivery
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_RETRY_BASE_SECONDS: int = 10
+    EMAIL_POLL_INTERVAL_SECONDS: float = 5.0
+    EMAIL_IDLE_DISCONNECT_SECONDS: int = 60
+
     class Config:
         env_file = ".env"
 
@@ -8,5 +8,14 @@ db = client["UrduWhiz"]
 collection = db["logs"]
 users_collection = db["Users"]
 sessions_collection = db["Sessions"]
-messages_collection=db['Nessages']
+messages_collection = db["Messages"]
+# One document per ingested PDF: collection name, owner and content hash
+books_collection = db["Books"]
+# Token usage of each Gemini chat answer (see backend/utils/token_usage.py)
+token_usage_collection = db["TokenUsage"]
+# Per-book FAQ answers and glossary generated at ingestion (see backend/utils/faq.py)
+book_faq_collection = db["BookFaq"]
+# Written by the LangGraph AsyncMongoDBSaver (default collection names)
+checkpoints_collection = db["checkpoints"]
+checkpoint_writes_collection = db["checkpoint_writes"]
 
@@ -7,13 +7,40 @@ import time,requests
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from fastapi.responses import JSONResponse
-from backend.utils.logger import log_to_db
+from fastapi.responses import JSONResponse, PlainTextResponse
+from backend.utils.logger import log_to_db, log_flusher
+from backend.utils.metrics import render_prometheus
 from backend.utils.limiter import limiter
+from backend.utils.graph import init_chat_graph
+from backend.utils.retention import retention_loop
+from backend.utils.indexes import ensure_indexes
+from backend.utils.email import outbox_worker
+from backend.utils.uploads import UploadSizeLimitMiddleware
+from backend.config import settings
+from advance_rag import ocr_router
+from contextlib import asynccontextmanager
+import asyncio
 import os
 
 
-app = FastAPI(title="UrduWhiz")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived resources shared by all requests
+    await ensure_indexes()
+    await init_chat_graph()
+    background_tasks = [
+        asyncio.create_task(retention_loop()),
+        asyncio.create_task(log_flusher()),
+        asyncio.create_task(outbox_worker()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    ocr_router.close()
+
+
+app = FastAPI(title="UrduWhiz", lifespan=lifespan)
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.getenv("FASTAPI_SECRET_KEY"),
@@ -25,7 +52,12 @@ app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, lambda request, exc: JSONResponse(
     status_code=429,
     content={"detail": "Rate limit exceeded"},
+    headers={"Retry-After": str(exc.limit.limit.get_expiry())},
 ))
+# Added before CORS so the 413 still carries CORS headers
+app.add_middleware(
+    UploadSizeLimitMiddleware, path="/api/pdf", max_bytes=settings.MAX_UPLOAD_MB * 1024 * 1024
+)
 
 
 app.add_middleware(
@@ -34,23 +66,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "Server-Timing", "Idempotent-Replayed"],
 )
 
 # # Logging time taken for each api request
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    response = await call_next(request)
-    log_to_db(
-        level="INFO",
-        message="Request received",
-        path=request.url.path,
-        ip=request.client.host
-    )
-    return response
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Only enqueues; the batched write happens in log_flusher()
+        log_to_db(
+            level="INFO" if status_code < 500 else "ERROR",
+            message="Request received",
+            user=getattr(request.state, "user_email", None),
+            path=request.url.path,
+            ip=request.client.host if request.client else None,
+            method=request.method,
+            status_code=status_code,
+            latency_ms=round((time.perf_counter() - started) * 1000, 2),
+        )
 
 app.include_router(auth.router, tags=["Auth"])
 app.include_router(api.router, tags=["Upload & Chat"], prefix="/api")
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to UrduWhiz"}
\ No newline at end of file
+    return {"message": "Welcome to UrduWhiz"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """Expose in-process metrics (batch sizes, latencies, ...) in Prometheus text format."""
+    return render_prometheus()
\ No newline at end of file
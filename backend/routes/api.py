@@ -1,39 +1,61 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response, Depends, Query
 from fastapi.responses import JSONResponse
 import os
+import json
+import hashlib
+import time
 import tempfile
 import uuid
 from typing import List
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
 from advance_rag import (
     convert_pdf_to_images, 
-    ocr_with_gemini, 
+    ocr_router, 
     summarize_and_extract_keywords, 
     chunk_extracted_text, 
     create_vector_db,
-    load_model,
-    hybrid_retrieve,
+    generate_book_faq,
+    answer_questions,
     qa_template,
-    create_workflow,
-    AsyncMongoDBSaver,
 )
 from qdrant_client import QdrantClient
 from backend.config import settings
 from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, AIMessage
-from backend.schemas.chat import ChatRequest, ChatResponse
-from backend.utils.auth import get_current_user
-from backend.database import sessions_collection
+from backend.schemas.chat import ChatRequest, ChatResponse, BatchChatRequest, BatchChatResponse, BatchAnswer
+from backend.utils.auth import get_current_user, get_admin_user
+from backend.utils.limiter import chat_quota, ingest_quota, batch_quota, SlotStreamingResponse
+from backend.database import sessions_collection, books_collection
 from backend.schemas.session import SessionRequest, SessionResponse
+from backend.utils.markdown import clean_markdown, MarkdownStreamCleaner
+from backend.utils.metrics import histogram
+from backend.utils.graph import get_chat_graph, get_checkpointer, chat_config
+from backend.utils.history import thread_lock, needs_compaction, schedule_compaction
+from backend.utils.retention import expire_thread
+from backend.utils import message_store
+from backend.utils.pagination import encode_cursor, decode_cursor
+from backend.utils.uploads import stream_upload_to_disk, validate_pdf_pages
+from backend.utils.timing import begin_timings, stage, timed
+from backend.utils.response_cache import idempotency_cache
+from backend.utils import token_usage
+from backend.utils.faq import save_book_faq, lookup_faq
+from backend.utils.token_usage import record_usage
+from backend.utils.library import invalidate_library
 from uuid import uuid4, UUID
-import re
 
 
 
 router = APIRouter()
 
+chat_ttft_histogram = histogram(
+    "chat_time_to_first_token_seconds", "Time from /api/chat/stream request to the first streamed token"
+)
+chat_latency_histogram = histogram(
+    "chat_response_seconds", "Total time to produce a chat answer"
+)
+
 def convert_mongo_doc(doc):
     """Convert MongoDB document to JSON-serializable dictionary."""
     if doc is None:
@@ -52,23 +74,8 @@ def convert_mongo_doc(doc):
     
     return doc
 
-def clean_markdown(text):
-    # Remove leading bullet points like *, -, or numbered lists
-    text = re.sub(r'^\s*[-*+]\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^\s*\d+\.\s*', '', text, flags=re.MULTILINE)
-
-    # Remove bold (**text**) and italic (*text* or _text_) formatting
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-    text = re.sub(r'_(.*?)_', r'\1', text)
-
-    # Remove extra whitespace
-    text = re.sub(r'\n{2,}', '\n', text).strip()
-
-    return text
-
 @router.post("/pdf")
-async def upload_pdf(request: Request, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+async def upload_pdf(request: Request, file: UploadFile = File(...), current_user: dict = Depends(get_current_user), _quota=Depends(ingest_quota)):
     """
     Upload a PDF file, process it with OCR, and store in vector database.
     
@@ -83,7 +90,19 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
+    book_faq_task = None
     try:
+        # Stream the upload to disk in chunks, validating the %PDF header,
+        # size limit and page count before any expensive work starts
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+            temp_file_path = temp_file.name
+            size_bytes, content_sha256 = await stream_upload_to_disk(
+                file, temp_file, max_bytes=settings.MAX_UPLOAD_MB * 1024 * 1024,
+                chunk_size=settings.UPLOAD_CHUNK_BYTES,
+            )
+        page_count = validate_pdf_pages(temp_file_path, settings.MAX_PDF_PAGES)
+        print(f"[INFO] Received '{file.filename}': {size_bytes} bytes, {page_count} pages, sha256={content_sha256}")
+
         # Create collection name based on filename with UUID
         base_filename = os.path.splitext(file.filename)[0]  # Remove .pdf extension
         # Generate a short UUID (6-7 characters)
@@ -107,38 +126,34 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
             # Store collection name in session for chat - make it user-specific
             user_collection_key = f"current_collection_{current_user['email']}"
             request.session[user_collection_key] = collection_name
+            os.unlink(temp_file_path)
             
             return JSONResponse(
                 status_code=200,
                 content={
                     "message": f"PDF '{file.filename}' already exists in the system!",
                     "status": "exists",
-                    "collection_name": collection_name
+                    "collection_name": collection_name,
+                    "sha256": content_sha256
                 }
             )
         
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
         # Process PDF using the RAG pipeline
         ocr_instruction = "Extract all Urdu text content accurately from the scanned pages."
         
         # Convert PDF to images
         with tempfile.TemporaryDirectory() as temp_dir:
             print(f"[INFO] Processing PDF: {file.filename}")
-            image_files = convert_pdf_to_images(temp_file_path, temp_dir)
+            # Rasterizing at 300 dpi and embedding the book are CPU-bound; keep them off the event loop
+            image_files = await asyncio.to_thread(convert_pdf_to_images, temp_file_path, temp_dir)
             
-            # Extract text using OCR
-            extracted_text = ocr_with_gemini(image_files, ocr_instruction)
+            # Extract text using OCR (engines chosen by OCR_POLICY)
+            extracted_text, ocr_report = await ocr_router.extract_text(image_files, ocr_instruction)
+            print(f"[INFO] OCR ({ocr_report['policy']}): {ocr_report['engine_pages']} in {ocr_report['seconds']}s")
             
-            # Load model for processing
-            model = load_model()
-            
-            # Generate summary and keywords
-            summary, keywords = summarize_and_extract_keywords(extracted_text, model)
+            # Generate summary and keywords, and the optional FAQ/glossary alongside
+            book_faq_task = asyncio.create_task(generate_book_faq(extracted_text)) if settings.BOOK_FAQ_ENABLED else None
+            summary, keywords = await summarize_and_extract_keywords(extracted_text)
             
             # Create text chunks
             text_chunks = chunk_extracted_text(extracted_text)
@@ -149,7 +164,8 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
                     "source_pdf": file.filename,
                     "summary": summary,
                     "keywords": keywords,
-                    "chunk_index": i
+                    "chunk_index": i,
+                    "content_sha256": content_sha256
                 }
             
             # Add dedicated summary chunk
@@ -160,7 +176,8 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
                     "type": "summary",
                     "keywords": keywords,
                     "summary": summary,
-                    "chunk_index": -1
+                    "chunk_index": -1,
+                    "content_sha256": content_sha256
                 }
             )
             text_chunks.append(summary_doc)
@@ -171,7 +188,27 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
             metadatas = [doc.metadata for doc in valid_documents]
             
             # Create vector database
-            create_vector_db(collection_name, texts, metadatas)
+            await asyncio.to_thread(create_vector_db, collection_name, texts, metadatas)
+            
+            if book_faq_task is not None:
+                try:
+                    await save_book_faq(collection_name, await book_faq_task)
+                except Exception as e:
+                    # The FAQ is an optimisation; the book is usable without it
+                    print(f"[WARN] Book FAQ generation failed for {collection_name}: {e}")
+            
+            # Register the book so identical uploads can be recognised by hash
+            await books_collection.insert_one({
+                "collection_name": collection_name,
+                "user_email": current_user["email"],
+                "filename": file.filename,
+                "sha256": content_sha256,
+                "size_bytes": size_bytes,
+                "page_count": page_count,
+                "ocr": {k: ocr_report[k] for k in ("policy", "engine_pages", "mean_local_confidence", "pages_per_second")},
+                "created_at": datetime.utcnow()
+            })
+            invalidate_library(current_user["email"])
             
             # Store collection name in session for chat - make it user-specific
             user_collection_key = f"current_collection_{current_user['email']}"
@@ -190,10 +227,15 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
             content={
                 "message": "PDF processed and stored successfully!",
                 "status": "new",
-                "collection_name": collection_name
+                "collection_name": collection_name,
+                "sha256": content_sha256
             }
         )
         
+    except HTTPException:
+        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+        raise
     except Exception as e:
         # Clean up temporary file if it exists
         if 'temp_file_path' in locals():
@@ -203,9 +245,95 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), current_use
                 pass
         
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    finally:
+        # Only awaited on success; don't leave it holding a Gemini slot after a failure
+        if book_faq_task is not None and not book_faq_task.done():
+            book_faq_task.cancel()
+
+async def _checkpoint_messages(session_id: str) -> list:
+    snapshot = await get_chat_graph().aget_state(chat_config(session_id))
+    return snapshot.values.get("messages", []) if snapshot else []
+
+async def _resolve_chat_session(payload: ChatRequest, request: Request, current_user: dict):
+    """
+    Resolve the collection and session id for this turn. Returns
+    (collection_name, session_id, new_session_doc, library); the doc is None
+    for an existing session, and library is True for sessions that search the
+    user's whole library (collection_name is then None). Session writes are
+    left to _save_chat_session; the only write here is the one-off backfill of
+    a legacy session's history, which must happen before the graph adds a turn.
+    """
+    timestamp = datetime.utcnow()
+    # Get collection name from session
+    collection_name = None
+    library = payload.scope == "library"
+    if payload.session_id:
+        session = await sessions_collection.find_one({
+            "session_id": payload.session_id,
+            "user_email": current_user["email"],
+            "visible": True
+        })
+        if session:
+            collection_name = session.get("collection_name")
+            library = session.get("scope") == "library"
+            if not session.get("backfilled"):
+                await message_store.ensure_backfilled(
+                    payload.session_id, current_user["email"], lambda: _checkpoint_messages(payload.session_id)
+                )
+    if library:
+        collection_name = None
+    elif not collection_name:
+        user_collection_key = f"current_collection_{current_user['email']}"
+        collection_name = request.session.get(user_collection_key)
+    if not collection_name and not library:
+        raise HTTPException(
+            status_code=400, 
+            detail="No PDF has been uploaded. Please upload a PDF first."
+        )
+    session_id = payload.session_id
+    if not session_id:
+        # Create new session
+        session_id = str(uuid.uuid4())
+        if library:
+            title = "Library chat"
+        else:
+            parts = collection_name.rsplit('-', 1)
+            base_filename = parts[0] if len(parts) > 1 else collection_name
+            title = f"{base_filename} chat"
+        session_doc = {
+            "session_id": session_id,
+            "user_email": current_user["email"],
+            "title": title,
+            "visible": True,
+            "created_at": timestamp,
+            "updated_at": timestamp,
+            "collection_name": collection_name,
+            "first_message": payload.query,
+            # New sessions have no checkpoint history to materialize
+            "backfilled": True
+        }
+        if library:
+            session_doc["scope"] = "library"
+        return collection_name, session_id, session_doc, library
+    return collection_name, session_id, None, library
+
+async def _save_chat_session(session_id: str, current_user: dict, new_session_doc: dict = None):
+    """Create the new session or touch an existing one. Independent of the graph run, so it runs alongside it."""
+    if new_session_doc:
+        await sessions_collection.insert_one(new_session_doc)
+    else:
+        # Update session timestamp
+        await sessions_collection.update_one(
+            {"session_id": session_id, "user_email": current_user["email"]},
+            {"$set": {"updated_at": datetime.utcnow()}}
+        )
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(payload: ChatRequest, request: Request, current_user: dict = Depends(get_current_user)):
+async def chat_endpoint(payload: ChatRequest, request: Request, response: Response, current_user: dict = Depends(get_current_user), _quota=Depends(chat_quota)):
     """
     Chat with the RAG system using LangGraph with session management.
     Uses LangGraph's built-in MongoDB persistence for conversation history.
@@ -215,201 +343,333 @@ async def chat_endpoint(payload: ChatRequest, request: Request, current_user: di
         request: FastAPI request
         
     Returns:
-        ChatResponse with answer, response_id, and session_id
+        ChatResponse with answer, response_id, and session_id.
+        Per-stage timings are returned in the Server-Timing header.
+
+    A client may send an Idempotency-Key header; a retry with the same key
+    (even while the first attempt is still running) gets the original answer
+    instead of generating again.
     """
     try:
-        response_id = uuid.uuid4()
-        timestamp = datetime.utcnow()
-        # Get collection name from session
-        collection_name = None
-        if payload.session_id:
-            from backend.database import sessions_collection
-            session = await sessions_collection.find_one({
-                "session_id": payload.session_id,
-                "user_email": current_user["email"],
-                "visible": True
-            })
-            if session:
-                collection_name = session.get("collection_name")
-        if not collection_name:
-            user_collection_key = f"current_collection_{current_user['email']}"
-            collection_name = request.session.get(user_collection_key)
-        if not collection_name:
-            raise HTTPException(
-                status_code=400, 
-                detail="No PDF has been uploaded. Please upload a PDF first."
-            )
-        session_id = payload.session_id
-        if not session_id:
-            # Create new session
-            session_id = str(uuid.uuid4())
-            parts = collection_name.rsplit('-', 1)
-            base_filename = parts[0] if len(parts) > 1 else collection_name
-            title = f"{base_filename} chat"
-            session_doc = {
-                "session_id": session_id,
-                "user_email": current_user["email"],
-                "title": title,
-                "visible": True,
-                "created_at": timestamp,
-                "updated_at": timestamp,
-                "collection_name": collection_name,
-                "first_message": payload.query
-            }
-            from backend.database import sessions_collection
-            await sessions_collection.insert_one(session_doc)
-        else:
-            # Update session timestamp
-            from backend.database import sessions_collection
-            await sessions_collection.update_one(
-                {"session_id": session_id, "user_email": current_user["email"]},
-                {"$set": {"updated_at": timestamp}}
-            )
-        # Use LangGraph workflow for conversation
-        mongo_uri = os.getenv("MONGO_URI")
-        if not mongo_uri:
-            raise HTTPException(status_code=500, detail="MongoDB URI not configured")
-        async with AsyncMongoDBSaver.from_conn_string(
-            mongo_uri,
-            db_name="UrduWhiz",
-        ) as checkpointer:
-            workflow = create_workflow(collection_name)
-            app = workflow.compile(checkpointer=checkpointer)
-            thread_id = session_id
-            config = {"configurable": {"thread_id": thread_id}}
-            try:
-                existing_state = await checkpointer.aget(config)
-                if existing_state and "channel_values" in existing_state and "messages" in existing_state["channel_values"]:
-                    from langchain_core.messages import HumanMessage
-                    existing_state["channel_values"]["messages"].append(HumanMessage(content=payload.query))
-                    state = existing_state
-                else:
-                    from langchain_core.messages import HumanMessage
-                    state = {"messages": [HumanMessage(content=payload.query)]}
-            except Exception as e:
-                from langchain_core.messages import HumanMessage
-                state = {"messages": [HumanMessage(content=payload.query)]}
-            if "channel_values" in state and "messages" in state["channel_values"]:
-                workflow_state = {"messages": state["channel_values"]["messages"]}
-            else:
-                workflow_state = state
-            result_state = await app.ainvoke(workflow_state, config)
-            if "channel_values" in result_state and "messages" in result_state["channel_values"]:
-                ai_message = result_state["channel_values"]["messages"][-1]
-            else:
-                ai_message = result_state["messages"][-1]
-            answer = ai_message.content
-            # Clean markdown from answer
-            answer = clean_markdown(answer)
-            return ChatResponse(
-                answer=answer,
-                response_id=response_id,
-                session_id=session_id
-            )
-        
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if not idempotency_key:
+            return ChatResponse(**await _answer_chat(payload, request, response, current_user))
+        fingerprint = hashlib.sha256(
+            json.dumps([payload.query, payload.session_id, payload.scope], ensure_ascii=False).encode()
+        ).hexdigest()
+        computed = []
+
+        async def compute():
+            computed.append(True)
+            return {"request": fingerprint, "response": await _answer_chat(payload, request, response, current_user)}
+
+        stored = await idempotency_cache.get_or_compute(f"{current_user['email']}:{idempotency_key}", compute)
+        if stored["request"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if not computed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return ChatResponse(**stored["response"])
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+async def _answer_chat(payload: ChatRequest, request: Request, response: Response, current_user: dict) -> dict:
+    """Run one blocking chat turn; returns the JSON-serializable ChatResponse fields."""
+    started = time.perf_counter()
+    timings = begin_timings()
+    asked_at = datetime.utcnow()
+    response_id = uuid.uuid4()
+    with stage("session_lookup"):
+        collection_name, session_id, new_session, library = await _resolve_chat_session(payload, request, current_user)
+    # Use LangGraph workflow for conversation; the checkpointer loads the
+    # history inside ainvoke and the reducer appends the new question.
+    app = get_chat_graph()
+    config = chat_config(session_id, collection_name, current_user["email"], library=library)
+    # Nothing is streamed from this endpoint, so slow Gemini calls may be hedged
+    config["configurable"]["hedge"] = True
+
+    async def run_graph():
+        async with thread_lock(session_id):
+            return await app.ainvoke({"messages": [HumanMessage(content=payload.query)]}, config)
+
+    # Session bookkeeping overlaps the checkpoint load and the RAG node
+    _, result_state = await asyncio.gather(
+        timed("session_write", _save_chat_session(session_id, current_user, new_session)),
+        timed("graph", run_graph()),
+    )
+    if needs_compaction(len(result_state["messages"])):
+        schedule_compaction(session_id)
+    ai_message = result_state["messages"][-1]
+    answer = ai_message.content
+    # Clean markdown from answer
+    answer = clean_markdown(answer)
+    with stage("record_turn"):
+        await message_store.record_turn(
+            session_id, current_user["email"], payload.query, answer, str(response_id), asked_at
+        )
+    chat_latency_histogram.observe(time.perf_counter() - started, mode="blocking")
+    response.headers["Server-Timing"] = timings.server_timing()
+    timings.log("chat")
+    return {
+        "answer": answer,
+        "response_id": str(response_id),
+        "session_id": session_id
+    }
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(payload: ChatRequest, request: Request, current_user: dict = Depends(get_current_user), quota_slot=Depends(chat_quota)):
+    """
+    Streaming variant of /chat over Server-Sent Events.
+
+    Emits a `meta` event with session_id and response_id, then `token` events
+    with markdown-stripped text as Gemini produces it, and finally `done` with
+    the full answer (or `error`). The final message is persisted to the
+    LangGraph checkpoint when the graph run completes. The `done` event
+    carries per-stage timings.
+    """
+    started = time.perf_counter()
+    timings = begin_timings()
+    asked_at = datetime.utcnow()
+    response_id = uuid.uuid4()
+    with stage("session_lookup"):
+        collection_name, session_id, new_session, library = await _resolve_chat_session(payload, request, current_user)
+    app = get_chat_graph()
+    config = chat_config(session_id, collection_name, current_user["email"], library=library)
+    # Hold the concurrency slot until the response finishes, not just until we return
+    if quota_slot is not None:
+        quota_slot.detach()
+
+    async def event_stream():
+        # The body is iterated outside the endpoint's context; re-attach the timings
+        begin_timings(timings)
+        yield _sse("meta", {"session_id": session_id, "response_id": str(response_id)})
+        cleaner = MarkdownStreamCleaner()
+        parts = []
+        # Session bookkeeping runs alongside the graph and is awaited before `done`
+        session_write = asyncio.create_task(
+            timed("session_write", _save_chat_session(session_id, current_user, new_session))
+        )
+        try:
+            new_turn = {"messages": [HumanMessage(content=payload.query)]}
+            message_count = 0
+            async with thread_lock(session_id):
+                with stage("graph"):
+                    # "values" carries the thread's state after each step, so the message
+                    # count comes from this run rather than another checkpoint read
+                    async for mode, chunk in app.astream(new_turn, config, stream_mode=["messages", "values"]):
+                        if mode == "values":
+                            message_count = len(chunk.get("messages", []))
+                            continue
+                        message, metadata = chunk
+                        if metadata.get("langgraph_node") != "rag" or not isinstance(message.content, str):
+                            continue
+                        text = cleaner.feed(message.content)
+                        if not text:
+                            continue
+                        if not parts:
+                            chat_ttft_histogram.observe(time.perf_counter() - started)
+                        parts.append(text)
+                        yield _sse("token", {"text": text})
+            if needs_compaction(message_count):
+                schedule_compaction(session_id)
+            tail = cleaner.flush()
+            if tail:
+                parts.append(tail)
+                yield _sse("token", {"text": tail})
+            answer = "".join(parts)
+            await session_write
+            with stage("record_turn"):
+                await message_store.record_turn(
+                    session_id, current_user["email"], payload.query, answer, str(response_id), asked_at
+                )
+            chat_latency_histogram.observe(time.perf_counter() - started, mode="stream")
+            timings.log("chat stream")
+            yield _sse("done", {"answer": answer, "timings": timings.as_dict()})
+        except Exception as e:
+            print(f"[ERROR] Error in chat stream: {str(e)}")
+            yield _sse("error", {"detail": f"Error generating response: {str(e)}"})
+        finally:
+            if not session_write.done():
+                await asyncio.shield(session_write)
+
+    return SlotStreamingResponse(
+        event_stream(),
+        quota_slot=quota_slot,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _resolve_batch_collection(payload: BatchChatRequest, request: Request, current_user: dict) -> str:
+    """Collection for a batch: an owned collection_name, else the session's, else the last upload's."""
+    if payload.collection_name:
+        owned = await books_collection.find_one(
+            {"collection_name": payload.collection_name, "user_email": current_user["email"]}, {"_id": 1}
+        ) or await sessions_collection.find_one(
+            {"collection_name": payload.collection_name, "user_email": current_user["email"]}, {"_id": 1}
+        )
+        if not owned:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        return payload.collection_name
+    if payload.session_id:
+        session = await sessions_collection.find_one(
+            {"session_id": payload.session_id, "user_email": current_user["email"], "visible": True},
+            {"collection_name": 1},
+        )
+        if session and session.get("collection_name"):
+            return session["collection_name"]
+    collection_name = request.session.get(f"current_collection_{current_user['email']}")
+    if not collection_name:
+        raise HTTPException(status_code=400, detail="No PDF has been uploaded. Please upload a PDF first.")
+    return collection_name
+
+@router.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(
+    payload: BatchChatRequest,
+    request: Request,
+    stream: bool = Query(False, description="Stream each answer as a Server-Sent Event when it completes"),
+    current_user: dict = Depends(get_current_user),
+    quota_slot=Depends(batch_quota),
+):
+    """
+    Answer a list of independent questions about one book (worksheets,
+    quizzes). All questions are embedded in one pass, searched in one batched
+    Qdrant request and packed into as few Gemini calls as the prompt budget
+    allows. Nothing is added to any chat session.
+
+    Returns the answers in question order, or with ?stream=true a `meta`
+    event, one `answer` event per question as it completes (any order, with
+    its index) and `done`.
+    """
+    questions = [question.strip() for question in payload.questions]
+    if len(questions) > settings.BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_QUESTIONS} questions per batch")
+    collection_name = await _resolve_batch_collection(payload, request, current_user)
+    answers = answer_questions(
+        questions, collection_name, faq_lookup=lookup_faq, usage_recorder=record_usage,
+        user_email=current_user["email"],
+    )
+
+    if not stream:
+        try:
+            results = [None] * len(questions)
+            async for index, answer, source in answers:
+                results[index] = BatchAnswer(
+                    index=index, question=questions[index], answer=clean_markdown(answer), source=source
+                )
+            return BatchChatResponse(collection_name=collection_name, answers=results)
+        except Exception as e:
+            print(f"[ERROR] Error in chat batch: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error generating answers: {str(e)}")
+
+    # Hold the concurrency slot until the response finishes
+    if quota_slot is not None:
+        quota_slot.detach()
+
+    async def event_stream():
+        yield _sse("meta", {"collection_name": collection_name, "count": len(questions)})
+        try:
+            async for index, answer, source in answers:
+                yield _sse("answer", {
+                    "index": index, "question": questions[index], "answer": clean_markdown(answer), "source": source
+                })
+            yield _sse("done", {"count": len(questions)})
+        except Exception as e:
+            print(f"[ERROR] Error in chat batch stream: {str(e)}")
+            yield _sse("error", {"detail": f"Error generating answers: {str(e)}"})
+        finally:
+            await answers.aclose()
+
+    return SlotStreamingResponse(
+        event_stream(),
+        quota_slot=quota_slot,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+SESSION_LIST_PROJECTION = {
+    "_id": 0, "session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "collection_name": 1,
+}
+
 @router.get("/sessions")
-async def get_sessions(current_user: dict = Depends(get_current_user)):
+async def get_sessions(
+    response: Response,
+    cursor: str = Query(None, description="Cursor from X-Next-Cursor to fetch the next page"),
+    limit: int = Query(100, ge=1, le=200),
+    current_user: dict = Depends(get_current_user),
+):
     """
-    Get all sessions for the current user.
+    Get the current user's sessions, most recently updated first. Uses keyset
+    pagination on (updated_at, session_id); the next page's cursor is returned
+    in the X-Next-Cursor header.
     """
     try:
-        print(f"[DEBUG] Getting sessions for user: {current_user['email']}")
-        from backend.database import sessions_collection
-        sessions_cursor = sessions_collection.find(
-            {"user_email": current_user["email"], "visible": True}
-        ).sort("updated_at", -1).limit(100)
-        
-        sessions = []
-        async for session in sessions_cursor:
-            converted_session = convert_mongo_doc(session)
-            sessions.append(converted_session)
-            print(f"[DEBUG] Found session: {converted_session}")
-        
-        print(f"[DEBUG] Total sessions found: {len(sessions)}")
-        return sessions
+        query = {"user_email": current_user["email"], "visible": True}
+        if cursor:
+            try:
+                updated_at, last_session_id = decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "session_id": {"$lt": last_session_id}},
+            ]
+        sessions_cursor = sessions_collection.find(query, SESSION_LIST_PROJECTION).sort(
+            [("updated_at", -1), ("session_id", -1)]
+        ).limit(limit + 1)
+        sessions = await sessions_cursor.to_list(length=limit + 1)
+        if len(sessions) > limit and sessions[limit - 1].get("updated_at"):
+            last = sessions[limit - 1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last["updated_at"], last["session_id"])
+        return [convert_mongo_doc(session) for session in sessions[:limit]]
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Error fetching sessions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching sessions: {str(e)}")
 
 @router.get("/sessions/{session_id}/messages")
-async def get_session_messages(session_id: str, current_user: dict = Depends(get_current_user)):
+async def get_session_messages(
+    session_id: str,
+    response: Response,
+    before: str = Query(None, description="Cursor from X-Next-Cursor to fetch older messages"),
+    limit: int = Query(message_store.DEFAULT_PAGE_SIZE, ge=1, le=message_store.MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+):
     """
-    Get all messages for a specific session using LangGraph's persistence.
+    Get a page of messages for a session from the materialized message store,
+    newest page first and each page in chronological order. When older
+    messages exist their cursor is returned in the X-Next-Cursor header.
     """
     try:
-        print(f"[DEBUG] Getting messages for session_id: {session_id}")
-        print(f"[DEBUG] For user_email: {current_user['email']}")
-        
         # Verify session belongs to user
-        from backend.database import sessions_collection
         session = await sessions_collection.find_one({
             "session_id": session_id,
             "user_email": current_user["email"],
             "visible": True
-        })
+        }, {"_id": 1, "updated_at": 1, "backfilled": 1})
         
         if not session:
             print(f"[DEBUG] Session {session_id} not found for user {current_user['email']}")
             return []
         
-        # Get messages from LangGraph's persistence
-        mongo_uri = os.getenv("MONGO_URI")
-        if not mongo_uri:
-            raise HTTPException(status_code=500, detail="MongoDB URI not configured")
-        
-        async with AsyncMongoDBSaver.from_conn_string(
-            mongo_uri,
-            db_name="UrduWhiz",
-        ) as checkpointer:
-            # Get the thread state from LangGraph
-            thread_id = session_id
-            config = {"configurable": {"thread_id": thread_id}}
-            
-            try:
-                # Try to get existing state using async method
-                print(f"[DEBUG] Attempting to get state for thread_id: {thread_id}")
-                
-                # First, let's try to list all checkpoints to see what's available
-                try:
-                    checkpoints = []
-                    async for checkpoint in checkpointer.alist(config):
-                        checkpoints.append(checkpoint)
-                    print(f"[DEBUG] Available checkpoints: {checkpoints}")
-                except Exception as list_error:
-                    print(f"[DEBUG] Could not list checkpoints: {list_error}")
-                
-                state = await checkpointer.aget(config)
-                print(f"[DEBUG] Retrieved state: {state}")
-                
-                if state and "channel_values" in state and "messages" in state["channel_values"]:
-                    messages = state["channel_values"]["messages"]
-                    print(f"[DEBUG] Retrieved {len(messages)} messages from LangGraph for session {session_id}")
-                    print(f"[DEBUG] Messages: {[f'{msg.type}: {msg.content[:50]}...' for msg in messages]}")
-                    
-                    # Convert LangGraph messages to frontend format
-                    formatted_messages = []
-                    for msg in messages:
-                        formatted_messages.append({
-                            "role": "user" if msg.type == "human" else "assistant",
-                            "content": msg.content,
-                            "timestamp": datetime.utcnow().isoformat()  # LangGraph doesn't store timestamps
-                        })
-                    
-                    return formatted_messages
-                else:
-                    print(f"[DEBUG] No messages found in LangGraph for session {session_id}")
-                    print(f"[DEBUG] State structure: {state}")
-                    return []
-                    
-            except Exception as e:
-                print(f"[DEBUG] Error getting messages from LangGraph: {str(e)}")
-                print(f"[DEBUG] Full error details: {e}")
-                return []
+        if not session.get("backfilled"):
+            # Session predates the message store: materialize it once from the checkpoint
+            await message_store.ensure_backfilled(
+                session_id, current_user["email"], lambda: _checkpoint_messages(session_id), session.get("updated_at")
+            )
+        try:
+            messages, next_cursor = await message_store.fetch_page(session_id, before=before, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return messages
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Error fetching messages: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching messages: {str(e)}")
@@ -425,6 +685,9 @@ async def delete_session(session_id: str, current_user: dict = Depends(get_curre
     print(f"Modified count: {result.modified_count}")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Session not found")
+    # Hidden sessions keep their checkpoints and messages only until the TTL expires
+    await expire_thread(session_id)
+    await message_store.expire_session_messages(session_id)
     return {"message": "Session deleted successfully"}
 
 @router.get("/sessions/{session_id}")
@@ -439,4 +702,40 @@ async def get_session(session_id: str, current_user: dict = Depends(get_current_
         raise HTTPException(status_code=404, detail="Session not found")
     return convert_mongo_doc(session)
 
- 
\ No newline at end of file
+ 
+
+@router.get("/usage")
+async def get_usage(
+    group_by: str = Query("session", pattern="^(session|collection|day)$"),
+    days: int = Query(None, ge=1, le=365, description="Only count the last N days"),
+    limit: int = Query(50, ge=1, le=token_usage.MAX_GROUPS),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Gemini token usage of the current user's chat answers, grouped by session,
+    collection or day and sorted by total tokens (most expensive first).
+    """
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    try:
+        return await token_usage.usage_summary(current_user["email"], group_by, since, limit)
+    except Exception as e:
+        print(f"[ERROR] Error fetching token usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching token usage: {str(e)}")
+
+@router.get("/admin/usage")
+async def get_admin_usage(
+    group_by: str = Query("user", pattern="^(session|collection|user|day)$"),
+    days: int = Query(None, ge=1, le=365, description="Only count the last N days"),
+    limit: int = Query(50, ge=1, le=token_usage.MAX_GROUPS),
+    admin_user: dict = Depends(get_admin_user),
+):
+    """
+    Token usage across all users (ADMIN_EMAILS only), e.g. to find the most
+    expensive users, books or sessions.
+    """
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    try:
+        return await token_usage.usage_summary(None, group_by, since, limit)
+    except Exception as e:
+        print(f"[ERROR] Error fetching token usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching token usage: {str(e)}")
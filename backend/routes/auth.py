@@ -7,7 +7,7 @@ from backend.utils.auth import (
     get_user_by_email, get_user_by_username, authenticate_user,
     create_access_token, create_refresh_token,
     create_email_verification_token, create_password_reset_token,
-    hash_password
+    hash_password_async
 )
 from backend.utils.email import send_email
 from backend.config import settings
@@ -15,6 +15,7 @@ from backend.database import users_collection
 from authlib.integrations.starlette_client import OAuth
 from starlette.config import Config
 from backend.utils.limiter import limiter
+from backend.utils.user_cache import get_cached_user, invalidate_user
 from uuid import uuid4
 from datetime import datetime, timedelta
 import requests
@@ -123,7 +124,7 @@ async def register(request: Request,user: UserRegister):
     if await get_user_by_username(user.username):
         raise HTTPException(status_code=400, detail="Username already taken")
 
-    hashed_pw = hash_password(user.password)
+    hashed_pw = await hash_password_async(user.password)
     user_id = str(uuid4())
     await users_collection.insert_one({
         "user_id": user_id,
@@ -169,7 +170,7 @@ async def get_me(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = await get_user_by_email(email)
+    user = await get_cached_user(email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -230,6 +231,7 @@ async def verify_email(request: Request,token: str):
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         await users_collection.update_one({"email": email}, {"$set": {"is_verified": True}})
+        await invalidate_user(email)
         return JSONResponse(content={"message": "Email verified successfully"})
     except JWTError:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
@@ -289,7 +291,9 @@ async def reset_password(request: Request,data: ResetPasswordSchema):
         user = await get_user_by_email(email)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        await users_collection.update_one({"email": email}, {"$set": {"hashed_password": hash_password(data.new_password)}})
+        hashed_pw = await hash_password_async(data.new_password)
+        await users_collection.update_one({"email": email}, {"$set": {"hashed_password": hashed_pw}})
+        await invalidate_user(email)
         return {"message": "Password has been reset successfully"}
     except JWTError:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
@@ -1,16 +1,33 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from uuid import UUID
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class ChatRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
+    # "library" searches every book the user has uploaded instead of one
+    scope: Literal["book", "library"] = "book"
 
 class ChatResponse(BaseModel):
     answer: str
     response_id: UUID
     session_id: str
+
+class BatchChatRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    collection_name: Optional[str] = None
+    session_id: Optional[str] = None
+
+class BatchAnswer(BaseModel):
+    index: int
+    question: str
+    answer: str
+    source: str
+
+class BatchChatResponse(BaseModel):
+    collection_name: str
+    answers: List[BatchAnswer]
    
    
    
\ No newline at end of file
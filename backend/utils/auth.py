@@ -1,16 +1,31 @@
 import bcrypt
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 from backend.config import settings
 from backend.database import users_collection
+from backend.utils.user_cache import get_cached_user, invalidate_user
+from backend.utils.metrics import histogram
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
+password_queue_histogram = histogram("password_hash_queue_seconds", "Time a bcrypt job waited for a worker")
+password_run_histogram = histogram("password_hash_run_seconds", "Duration of a bcrypt hash/verify")
+
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop.
+# The semaphore admits at most one job per worker; the rest wait in asyncio,
+# where their queue time is measurable.
+_password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = None
+
+
 def hash_password(password: str) -> bytes:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS))
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -19,6 +34,38 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password)
 
 
+def needs_rehash(hashed_password) -> bool:
+    """True when a stored hash was made with a cost other than BCRYPT_ROUNDS."""
+    if isinstance(hashed_password, bytes):
+        hashed_password = hashed_password.decode("utf-8")
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+async def _run_password_job(op: str, fn, *args):
+    global _password_slots
+    if _password_slots is None:
+        _password_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS)
+    queued = time.perf_counter()
+    async with _password_slots:
+        started = time.perf_counter()
+        password_queue_histogram.observe(started - queued, op=op)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_password_executor, fn, *args)
+        finally:
+            password_run_histogram.observe(time.perf_counter() - started, op=op)
+
+
+async def hash_password_async(password: str) -> bytes:
+    return await _run_password_job("hash", hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password) -> bool:
+    return await _run_password_job("verify", verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -52,11 +99,19 @@ async def get_user_by_username(username: str):
 
 async def authenticate_user(identifier: str, password: str):
     user = await get_user_by_username(identifier) or await get_user_by_email(identifier)
-    if not user or not verify_password(password, user["hashed_password"]):
+    if not user or not user.get("hashed_password"):
         return False
+    if not await verify_password_async(password, user["hashed_password"]):
+        return False
+    if needs_rehash(user["hashed_password"]):
+        # Cost factor changed since this hash was made; upgrade it while we have the password
+        new_hash = await hash_password_async(password)
+        await users_collection.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
+        await invalidate_user(user["email"])
+        user["hashed_password"] = new_hash
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
     """Get current user from JWT token"""
     credentials_exception = HTTPException(
         status_code=401,
@@ -71,7 +126,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = await users_collection.find_one({"email": email})
+    user = await get_cached_user(email)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    # Picked up by the request logging middleware
+    request.state.user_email = email
+    return user
+
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    """Current user, if listed in ADMIN_EMAILS; 403 otherwise."""
+    admins = {email.strip().lower() for email in settings.ADMIN_EMAILS.split(",") if email.strip()}
+    if current_user["email"].lower() not in admins:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backend.utils.metrics import histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+batch_size_histogram = histogram(
+    "model_batch_size", "Number of items per batched model forward pass", buckets=BATCH_SIZE_BUCKETS
+)
+batch_wait_histogram = histogram(
+    "model_batch_queue_seconds", "Time an item waited in the micro-batch queue"
+)
+batch_run_histogram = histogram(
+    "model_batch_run_seconds", "Duration of one batched model forward pass"
+)
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-item model calls into batched forward passes.
+
+    Callers ``await submit(item)``; items are collected until ``max_batch_size``
+    is reached or ``max_wait_ms`` has passed since the first item arrived, then
+    ``batch_fn(list_of_items)`` runs once in a worker thread and each caller's
+    future is resolved with its own row of the result.
+    """
+
+    def __init__(self, batch_fn, name: str, max_batch_size: int = 32, max_wait_ms: float = 5.0, executor=None):
+        self.batch_fn = batch_fn
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        # A single worker keeps forward passes serialized; requests arriving
+        # while one runs form the next batch.
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-batcher")
+        self._queue = None
+        self._loop = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item):
+        """Queue one item and wait for its result from the next batch."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def submit_many(self, items):
+        """Queue several items; they may be split across batches but keep their order."""
+        return await asyncio.gather(*(self.submit(item) for item in items))
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                batch_wait_histogram.observe(started - enqueued, batcher=self.name)
+            batch_size_histogram.observe(len(batch), batcher=self.name)
+            items = [item for item, _, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(self._executor, self.batch_fn, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(items)} inputs")
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            batch_run_histogram.observe(time.perf_counter() - started, batcher=self.name)
@@ -1,30 +1,176 @@
-import os
-from dotenv import load_dotenv
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+import asyncio
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import aiosmtplib
 from pydantic import EmailStr
+from pymongo import ReturnDocument
+from backend.config import settings
+from backend.database import db
+from backend.utils.metrics import counter
 
-load_dotenv()
+outbox_collection = db["EmailOutbox"]
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_FROM_NAME="UrduWhiz",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-)
+emails_sent_counter = counter("emails_sent_total", "Emails delivered to the SMTP server")
+email_failures_counter = counter("email_send_failures_total", "Failed SMTP delivery attempts")
+emails_dead_counter = counter("emails_dead_lettered_total", "Emails given up on after max attempts")
+
+# A "sending" claim older than this belongs to a worker that died mid-send.
+STALE_CLAIM = timedelta(minutes=5)
+
+_wakeup = None
+
+
+def _wakeup_event() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
 
-fast_mail = FastMail(conf)
 
 async def send_email(subject: str, recipients: list[EmailStr], html: str):
-    message = MessageSchema(
-        subject=subject,
-        recipients=recipients,
-        body=html,
-        subtype="html"
+    """Queue an email in the outbox; delivery happens in outbox_worker()."""
+    now = datetime.utcnow()
+    await outbox_collection.insert_one({
+        "subject": subject,
+        "recipients": list(recipients),
+        "html": html,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    })
+    _wakeup_event().set()
+
+
+class SMTPSender:
+    """Keeps one SMTP connection open and reuses it across emails."""
+
+    def __init__(self):
+        self._smtp = None
+        self._last_used = None
+
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.MAIL_SERVER,
+            port=settings.MAIL_PORT,
+            use_tls=settings.MAIL_SSL_TLS,
+            start_tls=settings.MAIL_STARTTLS,
+        )
+        try:
+            # connect() also runs STARTTLS when MAIL_STARTTLS is set
+            await smtp.connect()
+            if settings.MAIL_USE_CREDENTIALS:
+                await smtp.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)
+        except Exception:
+            # Don't leak the half-open connection (failed STARTTLS/login)
+            smtp.close()
+            raise
+        self._smtp = smtp
+
+    async def close(self):
+        if self._smtp is not None:
+            try:
+                await self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    async def close_if_idle(self):
+        if self._smtp is not None and datetime.utcnow() - self._last_used > timedelta(
+            seconds=settings.EMAIL_IDLE_DISCONNECT_SECONDS
+        ):
+            await self.close()
+
+    async def send(self, message: EmailMessage):
+        if self._smtp is None or not self._smtp.is_connected:
+            await self._connect()
+        try:
+            await self._smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # Server dropped the idle connection; reconnect once and retry.
+            self._smtp = None
+            await self._connect()
+            await self._smtp.send_message(message)
+        self._last_used = datetime.utcnow()
+
+
+def _build_message(doc: dict) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = doc["subject"]
+    message["From"] = f"UrduWhiz <{settings.MAIL_FROM}>"
+    message["To"] = ", ".join(doc["recipients"])
+    message.set_content(doc["html"], subtype="html")
+    return message
+
+
+async def _claim_next():
+    now = datetime.utcnow()
+    return await outbox_collection.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "claimed_at": {"$lt": now - STALE_CLAIM}},
+        ]},
+        {"$set": {"status": "sending", "claimed_at": now}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER,
     )
-    await fast_mail.send_message(message)
\ No newline at end of file
+
+
+async def _deliver(sender: SMTPSender, doc: dict):
+    try:
+        await sender.send(_build_message(doc))
+    except Exception as e:
+        email_failures_counter.inc()
+        await sender.close()
+        attempts = doc.get("attempts", 0) + 1
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            emails_dead_counter.inc()
+            print(f"[ERROR] Email {doc['_id']} dead-lettered after {attempts} attempts: {e}")
+            update = {"status": "dead", "attempts": attempts, "last_error": str(e)}
+        else:
+            backoff = settings.EMAIL_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            print(f"[WARN] Email {doc['_id']} failed (attempt {attempts}), retrying in {backoff}s: {e}")
+            update = {
+                "status": "pending",
+                "attempts": attempts,
+                "last_error": str(e),
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff),
+            }
+        await outbox_collection.update_one({"_id": doc["_id"]}, {"$set": update})
+    else:
+        emails_sent_counter.inc()
+        await outbox_collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.utcnow(), "attempts": doc.get("attempts", 0) + 1},
+             "$unset": {"html": ""}},
+        )
+
+
+async def outbox_worker():
+    """Background task: drain the outbox over a reused SMTP connection."""
+    sender = SMTPSender()
+    wakeup = _wakeup_event()
+    try:
+        while True:
+            # Clear before claiming: a send_email() after this point re-sets the event,
+            # so a wakeup between the claim and the wait is not lost
+            wakeup.clear()
+            try:
+                doc = await _claim_next()
+            except Exception as e:
+                print(f"[WARN] Could not read email outbox: {e}")
+                doc = None
+            if doc is not None:
+                try:
+                    await _deliver(sender, doc)
+                except Exception as e:
+                    # Usually a failed status update; the stale-claim sweep retries the email
+                    print(f"[ERROR] Could not record delivery of email {doc['_id']}: {e}")
+                continue
+            await sender.close_if_idle()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=settings.EMAIL_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await sender.close()
@@ -0,0 +1,122 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from backend.database import book_faq_collection
+from backend.utils.metrics import counter
+
+faq_lookups_counter = counter("book_faq_lookups_total", "Chat questions checked against the book FAQ, by result")
+
+# Trigger phrases per FAQ intent. A question matches only if nothing but
+# filler words is left once the phrase is removed, so "علی کے کردار کی
+# خصوصیات" still goes to the RAG pipeline.
+INTENT_PHRASES = {
+    "main_idea": ["مرکزی خیال", "خلاصہ", "موضوع", "کس بارے میں", "کس کے بارے میں"],
+    "characters": ["کردار", "کرداروں"],
+    "moral": ["سبق", "اخلاقی سبق", "نصیحت", "اخلاقی پیغام"],
+    "setting": ["کہاں کی", "کس جگہ", "کس زمانے", "مقام", "ماحول"],
+}
+
+FILLER_WORDS = frozenset("""
+    اس یہ وہ کہانی کتاب کا کی کے ہے ہیں تھا تھی تھے کیا کون کونسا کونسی کون سے سے کس کیسے بتائیں بتاؤ بتائیے
+    بتا دیں مجھے میں پر کو اور ذرا براہ کرم سب تمام اہم مرکزی بنیادی نے ملتا ملتی ملتے دیتی دیتا ہم ہمیں آپ
+    کیاہے لکھیں سمجھائیں مختصر مختصراً پوری ساری اِس
+""".split())
+
+# "<word> کا مطلب کیا ہے؟", "<word> کے معنی", "<word> سے کیا مراد ہے"
+WORD_MEANING_RE = re.compile(
+    r"^(?:لفظ\s+)?[\"'«“]?(?P<word>[^\s\"'»”]+(?:\s[^\s\"'»”]+)?)[\"'»”]?\s+"
+    r"(?:کا\s+مطلب|کے\s+معنی|کے\s+معنے|کا\s+معنی|کا\s+معنیٰ|سے\s+کیا\s+مراد)"
+)
+
+_PUNCTUATION_RE = re.compile(r"[؟?۔.،,!:;()\[\]{}]+")
+
+CACHE_MAXSIZE = 256
+CACHE_TTL_SECONDS = 600
+# Books without a FAQ yet (e.g. one still being generated right after upload)
+# are re-checked soon rather than treated as FAQ-less for the full TTL
+MISS_TTL_SECONDS = 15
+_cache = OrderedDict()
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def _build_index(doc: dict) -> dict:
+    return {
+        "intents": {item["intent"]: item["answer"] for item in doc.get("faq", []) if item["intent"] != "other"},
+        "questions": {normalize_text(item["question"]): item["answer"] for item in doc.get("faq", [])},
+        "glossary": {normalize_text(item["word"]): item for item in doc.get("glossary", [])},
+    }
+
+
+def _glossary_answer(entry: dict) -> str:
+    # Same shape the prompt asks Gemini to use for word meanings
+    answer = f"{entry['word']} کا مطلب ہے {entry['meaning'].rstrip('۔')}۔"
+    if entry.get("example"):
+        answer += f" جملہ: {entry['example']}"
+    return answer
+
+
+def match_faq(index: dict, question: str):
+    """Return (kind, answer) for a confident match against one book's FAQ index, or None."""
+    normalized = normalize_text(question)
+    if not normalized:
+        return None
+    if normalized in index["questions"]:
+        return "question", index["questions"][normalized]
+    meaning = WORD_MEANING_RE.match(normalized)
+    if meaning:
+        entry = index["glossary"].get(meaning.group("word"))
+        return ("glossary", _glossary_answer(entry)) if entry else None
+    for intent, phrases in INTENT_PHRASES.items():
+        answer = index["intents"].get(intent)
+        if not answer:
+            continue
+        for phrase in phrases:
+            if phrase in normalized:
+                leftover = normalized.replace(phrase, " ").split()
+                if all(word in FILLER_WORDS for word in leftover):
+                    return intent, answer
+    return None
+
+
+async def _load_index(collection_name: str):
+    entry = _cache.get(collection_name)
+    if entry and entry[0] > time.monotonic():
+        _cache.move_to_end(collection_name)
+        return entry[1]
+    doc = await book_faq_collection.find_one({"collection_name": collection_name})
+    index = _build_index(doc) if doc else None
+    ttl = CACHE_TTL_SECONDS if index is not None else MISS_TTL_SECONDS
+    _cache[collection_name] = (time.monotonic() + ttl, index)
+    _cache.move_to_end(collection_name)
+    while len(_cache) > CACHE_MAXSIZE:
+        _cache.popitem(last=False)
+    return index
+
+
+async def lookup_faq(collection_name: str, question: str):
+    """FAQ/glossary answer for a question about a book, or None to run the RAG pipeline."""
+    try:
+        index = await _load_index(collection_name)
+    except Exception as e:
+        print(f"[WARN] Book FAQ lookup failed: {e}")
+        return None
+    match = match_faq(index, question) if index else None
+    faq_lookups_counter.inc(result=match[0] if match else "miss")
+    return match[1] if match else None
+
+
+async def save_book_faq(collection_name: str, book_faq: dict):
+    """Store the FAQ and glossary generated for a book at ingestion."""
+    await book_faq_collection.update_one(
+        {"collection_name": collection_name},
+        {"$set": {**book_faq, "collection_name": collection_name, "created_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    _cache.pop(collection_name, None)
@@ -0,0 +1,53 @@
+import asyncio
+from advance_rag import create_workflow, get_encoders, AsyncMongoDBSaver
+from backend.database import client
+from backend.utils.response_cache import answer_cache
+from backend.utils.token_usage import record_usage
+from backend.utils.faq import lookup_faq
+from backend.utils.library import user_collections
+
+# Created once on application startup (see backend/main.py lifespan) and
+# shared by every request: the checkpointer rides on the pooled Motor client
+# and the compiled graph takes the collection from the run config.
+checkpointer = None
+chat_graph = None
+
+
+async def init_chat_graph():
+    global checkpointer, chat_graph
+    # Load the embedding and reranker models now rather than on the first question
+    await asyncio.to_thread(get_encoders)
+    checkpointer = AsyncMongoDBSaver(client, db_name="UrduWhiz")
+    chat_graph = create_workflow(
+        response_cache=answer_cache, usage_recorder=record_usage, faq_lookup=lookup_faq,
+        library_collections=user_collections,
+    ).compile(checkpointer=checkpointer)
+    print("[INFO] Chat graph compiled with shared MongoDB checkpointer")
+
+
+def get_chat_graph():
+    if chat_graph is None:
+        raise RuntimeError("Chat graph not initialised; init_chat_graph() runs on application startup")
+    return chat_graph
+
+
+def get_checkpointer():
+    if checkpointer is None:
+        raise RuntimeError("Checkpointer not initialised; init_chat_graph() runs on application startup")
+    return checkpointer
+
+
+def chat_config(session_id: str, collection_name: str = None, user_email: str = None, library: bool = False) -> dict:
+    """
+    Run config for one chat thread; collection_name selects the Qdrant
+    collection and user_email attributes token usage. With library=True the
+    turn searches all of the user's collections instead.
+    """
+    configurable = {"thread_id": session_id}
+    if collection_name:
+        configurable["collection_name"] = collection_name
+    if user_email:
+        configurable["user_email"] = user_email
+    if library:
+        configurable["library"] = True
+    return {"configurable": configurable}
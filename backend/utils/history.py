@@ -0,0 +1,84 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from advance_rag import compact_history, HISTORY_COMPACT_AFTER
+from backend.utils.graph import get_chat_graph, chat_config
+from backend.config import settings
+from backend.utils.metrics import counter, histogram
+from backend.utils.redis_client import get_redis
+
+compactions_counter = counter("chat_history_compactions_total", "Chat threads compacted into a rolling summary")
+compaction_errors_counter = counter("chat_history_compaction_errors_total", "Failed background history compactions")
+compaction_histogram = histogram("chat_history_compaction_seconds", "Duration of a background history compaction")
+
+_thread_locks = weakref.WeakValueDictionary()
+_pending = set()
+_tasks = set()
+
+
+def _local_lock(thread_id: str) -> asyncio.Lock:
+    lock = _thread_locks.get(thread_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _thread_locks[thread_id] = lock
+    return lock
+
+
+@asynccontextmanager
+async def thread_lock(thread_id: str):
+    """
+    Per-thread lock shared by chat turns and compaction's state update, so a
+    compaction never forks the checkpoint chain underneath a running turn.
+    Within a worker it is an asyncio.Lock; with REDIS_URL set a Redis lock is also taken so turns
+    in different workers are serialized too (without Redis, only one worker
+    may serve chat safely).
+    """
+    async with _local_lock(thread_id):
+        redis = get_redis()
+        if redis is None:
+            yield
+            return
+        lock = redis.lock(
+            f"urduwhiz:thread-lock:{thread_id}",
+            timeout=settings.THREAD_LOCK_TTL_SECONDS,
+            blocking_timeout=settings.THREAD_LOCK_WAIT_SECONDS,
+        )
+        if not await lock.acquire():
+            raise TimeoutError(f"Timed out waiting for chat thread {thread_id}")
+        try:
+            yield
+        finally:
+            try:
+                await lock.release()
+            except Exception as e:
+                # Expired (held past THREAD_LOCK_TTL_SECONDS) or Redis unreachable
+                print(f"[WARN] Could not release lock for thread {thread_id}: {e}")
+
+
+def needs_compaction(message_count: int) -> bool:
+    return message_count > HISTORY_COMPACT_AFTER
+
+
+def schedule_compaction(thread_id: str):
+    """Compact the thread in the background, outside the response's critical path."""
+    if thread_id in _pending:
+        return
+    _pending.add(thread_id)
+    task = asyncio.create_task(_compact(thread_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _compact(thread_id: str):
+    started = time.perf_counter()
+    try:
+        # Summarizing is a full Gemini call, so the lock is only held for the state update
+        if await compact_history(get_chat_graph(), chat_config(thread_id), lock=lambda: thread_lock(thread_id)):
+            compactions_counter.inc()
+            compaction_histogram.observe(time.perf_counter() - started)
+    except Exception as e:
+        compaction_errors_counter.inc()
+        print(f"[WARN] History compaction failed for thread {thread_id}: {e}")
+    finally:
+        _pending.discard(thread_id)
@@ -0,0 +1,113 @@
+import asyncio
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from backend.utils.email import outbox_collection
+from backend.database import (
+    collection as logs_collection,
+    users_collection,
+    sessions_collection,
+    messages_collection,
+    books_collection,
+    token_usage_collection,
+    book_faq_collection,
+    checkpoints_collection,
+    checkpoint_writes_collection,
+)
+
+# Every index the app relies on, declared in one place and created on
+# startup. create_index is a no-op when an identical index already exists.
+INDEX_SPECS = [
+    # Auth lookups by email on every authenticated request; by username on login.
+    (users_collection, [("email", ASCENDING)], {"unique": True}),
+    # Not unique: Google sign-ins store display names, which can collide.
+    # /auth/register still rejects taken usernames.
+    (users_collection, [("username", ASCENDING)], {}),
+    (sessions_collection, [("session_id", ASCENDING)], {"unique": True}),
+    # Session listing: equality on user/visible, sorted by updated_at with session_id as keyset tiebreak.
+    (sessions_collection, [("user_email", ASCENDING), ("visible", ASCENDING),
+                           ("updated_at", DESCENDING), ("session_id", DESCENDING)], {}),
+    (messages_collection, [("session_id", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)], {}),
+    (messages_collection, [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    # Idempotent backfill of legacy threads: one message per thread position.
+    (messages_collection, [("session_id", ASCENDING), ("legacy_index", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"legacy_index": {"$exists": True}}}),
+    (checkpoints_collection, [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING),
+                              ("checkpoint_id", DESCENDING)], {}),
+    (checkpoints_collection, [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    (checkpoint_writes_collection, [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING),
+                                    ("checkpoint_id", DESCENDING)], {}),
+    (checkpoint_writes_collection, [("expire_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    # Book registry: a user's library, and dedup of identical uploads by content hash.
+    (books_collection, [("user_email", ASCENDING), ("created_at", DESCENDING)], {}),
+    (books_collection, [("sha256", ASCENDING)], {}),
+    (book_faq_collection, [("collection_name", ASCENDING)], {"unique": True}),
+    # /api/usage: one user's answers, optionally since a date.
+    (token_usage_collection, [("user_email", ASCENDING), ("ts", DESCENDING)], {}),
+    # /api/admin/usage: all users' answers since a date.
+    (token_usage_collection, [("ts", DESCENDING)], {}),
+    (logs_collection, [("timestamp", DESCENDING)], {}),
+    # Outbox claim: next due pending email (and stale "sending" claims).
+    (outbox_collection, [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+]
+
+# Hot queries whose plans must be index scans: (name, collection, filter, sort)
+HOT_QUERIES = [
+    ("user_by_email", users_collection, {"email": "probe@example.com"}, None),
+    ("user_by_username", users_collection, {"username": "probe"}, None),
+    ("session_for_turn", sessions_collection,
+     {"session_id": "probe", "user_email": "probe@example.com", "visible": True}, None),
+    ("session_listing", sessions_collection, {"user_email": "probe@example.com", "visible": True},
+     [("updated_at", DESCENDING), ("session_id", DESCENDING)]),
+    ("session_messages", messages_collection, {"session_id": "probe"},
+     [("ts", DESCENDING), ("_id", DESCENDING)]),
+    ("thread_checkpoints", checkpoints_collection, {"thread_id": "probe", "checkpoint_ns": ""},
+     [("checkpoint_id", DESCENDING)]),
+]
+
+
+async def ensure_indexes():
+    """Create all declared indexes; conflicts are reported, not fatal."""
+    for collection, keys, options in INDEX_SPECS:
+        try:
+            await collection.create_index(keys, **options)
+        except OperationFailure as e:
+            print(f"[WARN] Could not create index {keys} on {collection.name}: {e}")
+    print(f"[INFO] Ensured {len(INDEX_SPECS)} MongoDB indexes")
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def verify_query_plans() -> dict:
+    """
+    Explain each hot query and return {name: [winning plan stages]}. Raises
+    RuntimeError if any of them would fall back to a collection scan.
+    """
+    plans = {}
+    for name, collection, query, sort in HOT_QUERIES:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = list(_stages(explain["queryPlanner"]["winningPlan"]))
+        plans[name] = stages
+    scans = [name for name, stages in plans.items() if "COLLSCAN" in stages or "IXSCAN" not in stages]
+    if scans:
+        raise RuntimeError(f"Queries not served by an index: {scans} ({plans})")
+    return plans
+
+
+if __name__ == "__main__":
+    # python -m backend.utils.indexes  -> create indexes and check the hot query plans
+    async def _main():
+        await ensure_indexes()
+        for name, stages in (await verify_query_plans()).items():
+            print(f"[INFO] {name}: {' <- '.join(s for s in stages if s)}")
+
+    asyncio.run(_main())
@@ -0,0 +1,28 @@
+import time
+from backend.database import books_collection, sessions_collection
+
+CACHE_TTL_SECONDS = 30
+_cache = {}
+
+
+async def user_collections(user_email: str) -> list:
+    """
+    Every Qdrant collection a user owns: books registered at upload plus
+    collections referenced by their sessions (uploads that predate the
+    registry). Cached briefly since library chats ask on every turn.
+    """
+    entry = _cache.get(user_email)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    registered = await books_collection.distinct("collection_name", {"user_email": user_email})
+    from_sessions = await sessions_collection.distinct(
+        "collection_name", {"user_email": user_email, "collection_name": {"$ne": None}}
+    )
+    collections = sorted(set(registered) | set(from_sessions))
+    _cache[user_email] = (time.monotonic() + CACHE_TTL_SECONDS, collections)
+    return collections
+
+
+def invalidate_library(user_email: str):
+    """Forget the cached library after an upload."""
+    _cache.pop(user_email, None)
@@ -1,4 +1,209 @@
+import math
+import time
+import asyncio
+from fastapi import Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
+from backend.config import settings
+from backend.utils.auth import get_current_user
+from backend.utils.metrics import counter
+from backend.utils.redis_client import get_redis
 
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+# Per-IP limits on the auth routes. Shared storage keeps them global across
+# workers instead of multiplying with the worker count.
+limiter = Limiter(key_func=get_remote_address, storage_uri=settings.REDIS_URL or "memory://")
+
+quota_rejections_counter = counter("quota_rejections_total", "Requests rejected by per-user quotas")
+
+# Atomic token bucket: refills at `rate` tokens/second up to `capacity`.
+# Returns {allowed, seconds until a token is available}.
+_TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class MemoryQuotaStore:
+    """Single-process fallback used when REDIS_URL is not configured."""
+
+    SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self):
+        # key -> (tokens, last update, time the bucket is full again)
+        self._buckets = {}
+        self._active = {}
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now: float):
+        # A full bucket behaves exactly like a missing one, so refilled buckets can go
+        self._last_sweep = now
+        for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+            del self._buckets[key]
+
+    async def take_token(self, key: str, rate: float, capacity: float):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.SWEEP_INTERVAL_SECONDS:
+            self._sweep(now)
+        tokens, ts, _ = self._buckets.get(key, (capacity, now, now))
+        tokens = min(capacity, tokens + (now - ts) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return (True, 0.0) if allowed else (False, (1 - tokens) / rate)
+
+    async def acquire_slot(self, key: str, limit: int) -> bool:
+        if self._active.get(key, 0) >= limit:
+            return False
+        self._active[key] = self._active.get(key, 0) + 1
+        return True
+
+    async def release_slot(self, key: str):
+        remaining = self._active.get(key, 0) - 1
+        if remaining > 0:
+            self._active[key] = remaining
+        else:
+            self._active.pop(key, None)
+
+
+class RedisQuotaStore:
+    """Quota state shared by every worker through Redis."""
+
+    # Safety net: a worker that dies mid-request cannot hold a slot forever.
+    SLOT_TTL_SECONDS = 600
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._bucket_script = redis.register_script(_TOKEN_BUCKET_LUA)
+
+    async def take_token(self, key: str, rate: float, capacity: float):
+        allowed, retry_after = await self._bucket_script(keys=[f"quota:bucket:{key}"], args=[rate, capacity])
+        return bool(int(allowed)), float(retry_after)
+
+    async def acquire_slot(self, key: str, limit: int) -> bool:
+        slot_key = f"quota:active:{key}"
+        active = await self.redis.incr(slot_key)
+        if active == 1:
+            # Only when the counter is created: refreshing it on every attempt
+            # would keep a leaked count alive for as long as the user retries
+            await self.redis.expire(slot_key, self.SLOT_TTL_SECONDS)
+        if active > limit:
+            await self.redis.decr(slot_key)
+            return False
+        return True
+
+    async def release_slot(self, key: str):
+        await self.redis.decr(f"quota:active:{key}")
+
+
+def _create_store():
+    redis = get_redis()
+    return RedisQuotaStore(redis) if redis is not None else MemoryQuotaStore()
+
+
+quota_store = _create_store()
+
+
+class QuotaSlot:
+    """
+    A held concurrency slot. Released when the dependency exits unless the
+    endpoint calls detach() to keep it for a streamed response, in which case
+    the endpoint returns a SlotStreamingResponse that releases it.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.detached = False
+        self._released = False
+
+    def detach(self):
+        self.detached = True
+        return self
+
+    async def release(self):
+        if not self._released:
+            self._released = True
+            await quota_store.release_slot(self.key)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that releases a detached QuotaSlot however the response
+    ends, including a client that disconnects before the body is iterated
+    (when the generator's own ``finally`` never runs).
+    """
+
+    def __init__(self, content, quota_slot: QuotaSlot = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.quota_slot = quota_slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.quota_slot is not None:
+                await asyncio.shield(self.quota_slot.release())
+
+
+def _reject(name: str, detail: str, retry_after: float):
+    quota_rejections_counter.inc(quota=name)
+    raise HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def user_quota(name: str, rate_per_minute: float, burst: int, max_concurrent: int = 0):
+    """
+    Dependency factory enforcing a per-user token bucket (``rate_per_minute``
+    sustained, ``burst`` at once) and optionally at most ``max_concurrent``
+    in-flight requests. Rejections are 429s with a Retry-After header.
+    """
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        key = f"{name}:{current_user['email']}"
+        allowed, retry_after = await quota_store.take_token(key, rate_per_minute / 60.0, burst)
+        if not allowed:
+            _reject(name, "Rate limit exceeded", retry_after)
+        if not max_concurrent:
+            yield None
+            return
+        if not await quota_store.acquire_slot(key, max_concurrent):
+            _reject(name, "Too many requests in progress", 1)
+        slot = QuotaSlot(key)
+        try:
+            yield slot
+        finally:
+            if not slot.detached:
+                await asyncio.shield(slot.release())
+
+    return dependency
+
+
+chat_quota = user_quota(
+    "chat", settings.CHAT_RATE_PER_MINUTE, settings.CHAT_BURST, settings.CHAT_MAX_CONCURRENT
+)
+batch_quota = user_quota(
+    "batch", settings.BATCH_RATE_PER_MINUTE, settings.BATCH_BURST, settings.BATCH_MAX_CONCURRENT
+)
+ingest_quota = user_quota(
+    "ingest", settings.INGEST_RATE_PER_MINUTE, settings.INGEST_BURST, settings.INGEST_MAX_CONCURRENT
+)
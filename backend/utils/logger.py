@@ -1,9 +1,34 @@
-from backend.database import db
+import asyncio
+import time
 from datetime import datetime
+from backend.config import settings
+from backend.database import db
+from backend.utils.metrics import counter, gauge
 
 log_collection = db["logs"]
 
-def log_to_db(level: str, message: str, user: str = None, path: str = None, ip: str = None):
+logs_written_counter = counter("request_logs_written_total", "Log entries written to MongoDB")
+logs_dropped_counter = counter("request_logs_dropped_total", "Log entries dropped because the queue was full")
+log_flush_errors_counter = counter("request_log_flush_errors_total", "Failed log batch inserts")
+log_queue_gauge = gauge("request_log_queue_depth", "Log entries waiting to be flushed")
+
+# Bounded in-memory buffer drained by log_flusher(); created on first use so
+# it binds to the running event loop.
+_log_queue = None
+
+
+def _queue() -> asyncio.Queue:
+    global _log_queue
+    if _log_queue is None:
+        _log_queue = asyncio.Queue(maxsize=settings.LOG_QUEUE_MAXSIZE)
+    return _log_queue
+
+
+def log_to_db(level: str, message: str, user: str = None, path: str = None, ip: str = None, **fields):
+    """
+    Queue a log entry without blocking the request. When the queue is full the
+    entry is dropped and counted rather than slowing the caller down.
+    """
     log_entry = {
         "timestamp": datetime.utcnow(),
         "level": level.upper(),
@@ -11,5 +36,53 @@ def log_to_db(level: str, message: str, user: str = None, path: str = None, ip:
         "user": user,
         "path": path,
         "ip": ip,
+        **fields,
     }
-    log_collection.insert_one(log_entry)
\ No newline at end of file
+    try:
+        _queue().put_nowait(log_entry)
+    except asyncio.QueueFull:
+        logs_dropped_counter.inc()
+
+
+async def _write(batch: list):
+    try:
+        await log_collection.insert_many(batch, ordered=False)
+        logs_written_counter.inc(len(batch))
+    except Exception as e:
+        log_flush_errors_counter.inc()
+        print(f"[WARN] Could not write {len(batch)} log entries: {e}")
+
+
+async def log_flusher():
+    """
+    Background task: flush queued entries with one insert_many per
+    LOG_BATCH_SIZE entries or LOG_FLUSH_INTERVAL_SECONDS, whichever comes first.
+    """
+    queue = _queue()
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + settings.LOG_FLUSH_INTERVAL_SECONDS
+            while len(batch) < settings.LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            log_queue_gauge.set(queue.qsize())
+            await _write(batch)
+    except asyncio.CancelledError:
+        await flush_logs()
+        raise
+
+
+async def flush_logs():
+    """Write out whatever is still queued (used on shutdown)."""
+    queue = _queue()
+    batch = []
+    while not queue.empty():
+        batch.append(queue.get_nowait())
+    if batch:
+        await _write(batch)
@@ -0,0 +1,87 @@
+import re
+
+
+def clean_markdown(text):
+    # Remove leading bullet points like *, -, or numbered lists
+    text = re.sub(r'^\s*[-*+]\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^\s*\d+\.\s*', '', text, flags=re.MULTILINE)
+
+    # Remove bold (**text**) and italic (*text* or _text_) formatting
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'_(.*?)_', r'\1', text)
+
+    # Remove extra whitespace
+    text = re.sub(r'\n{2,}', '\n', text).strip()
+
+    return text
+
+
+class MarkdownStreamCleaner:
+    """
+    Incremental counterpart of ``clean_markdown`` for streamed answers.
+
+    Line-start markers (bullets, ``1.``) are held back only until the first
+    real character of the line arrives; emphasis markers are dropped as they
+    stream, blank-line runs collapse to one newline and leading/trailing
+    newlines are never emitted.
+    """
+
+    _PREFIX_CHARS = frozenset(" \t-*+.0123456789")
+    _EMPHASIS_CHARS = frozenset("*_")
+
+    def __init__(self):
+        self._line_prefix = ""
+        self._at_line_start = True
+        self._pending_newline = False
+        self._started = False
+
+    @staticmethod
+    def _strip_prefix(prefix: str) -> str:
+        prefix = re.sub(r'^\s*[-*+]\s*', '', prefix)
+        prefix = re.sub(r'^\s*\d+\.\s*', '', prefix)
+        return prefix.replace("*", "").replace("_", "")
+
+    def _emit(self, out: list, text: str):
+        if not self._started:
+            text = text.lstrip()
+        if not text:
+            return
+        if self._pending_newline:
+            out.append("\n")
+            self._pending_newline = False
+        out.append(text)
+        self._started = True
+
+    def feed(self, chunk: str) -> str:
+        """Consume a streamed chunk and return the cleaned text that is safe to emit now."""
+        out = []
+        for ch in chunk:
+            if ch == "\n":
+                if self._at_line_start and self._line_prefix.strip():
+                    self._emit(out, self._strip_prefix(self._line_prefix))
+                self._line_prefix = ""
+                self._at_line_start = True
+                if self._started:
+                    self._pending_newline = True
+                continue
+            if self._at_line_start:
+                if ch in self._PREFIX_CHARS:
+                    self._line_prefix += ch
+                    continue
+                self._emit(out, self._strip_prefix(self._line_prefix))
+                self._line_prefix = ""
+                self._at_line_start = False
+            if ch in self._EMPHASIS_CHARS:
+                continue
+            self._emit(out, ch)
+        return "".join(out)
+
+    def flush(self) -> str:
+        """Return whatever is still held back once the stream has ended."""
+        out = []
+        if self._at_line_start and self._line_prefix.strip():
+            self._emit(out, self._strip_prefix(self._line_prefix).rstrip())
+        self._line_prefix = ""
+        self._pending_newline = False
+        return "".join(out)
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, UpdateOne
+from backend.config import settings
+from backend.database import messages_collection, sessions_collection
+from backend.utils.pagination import encode_cursor, decode_cursor
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _format(doc: dict) -> dict:
+    return {
+        "role": doc["role"],
+        "content": doc["content"],
+        "timestamp": doc["ts"].isoformat(),
+        "response_id": doc.get("response_id"),
+    }
+
+
+async def record_turn(session_id: str, user_email: str, question: str, answer: str,
+                      response_id: str, asked_at: datetime, answered_at: datetime = None):
+    """Materialize one question/answer pair with its real timestamps."""
+    answered_at = answered_at or datetime.utcnow()
+    await messages_collection.insert_many([
+        {"session_id": session_id, "user_email": user_email, "role": "user",
+         "content": question, "ts": asked_at, "response_id": response_id},
+        {"session_id": session_id, "user_email": user_email, "role": "assistant",
+         "content": answer, "ts": answered_at, "response_id": response_id},
+    ], ordered=True)
+
+
+async def backfill_from_checkpoint(session_id: str, user_email: str, messages: list, ended_at: datetime) -> list:
+    """
+    Materialize a thread that predates the message store. Real timestamps were
+    never recorded, so messages are spaced a millisecond apart ending at
+    ``ended_at`` to keep their order stable. Each message is upserted on its
+    position in the thread, so running this twice does not duplicate it.
+    """
+    docs = [
+        {
+            "session_id": session_id,
+            "user_email": user_email,
+            "role": "user" if msg.type == "human" else "assistant",
+            "content": msg.content,
+            "ts": ended_at - timedelta(milliseconds=len(messages) - i),
+            "backfilled": True,
+            "legacy_index": i,
+        }
+        for i, msg in enumerate(messages)
+    ]
+    if docs:
+        await messages_collection.bulk_write([
+            UpdateOne({"session_id": session_id, "legacy_index": doc["legacy_index"]},
+                      {"$setOnInsert": doc}, upsert=True)
+            for doc in docs
+        ], ordered=False)
+    return docs
+
+
+async def ensure_backfilled(session_id: str, user_email: str, load_messages, ended_at: datetime = None) -> bool:
+    """
+    Backfill a legacy session once, before its first new turn or history read.
+    The session's ``backfilled`` flag is claimed atomically, so concurrent
+    callers do not both backfill; ``load_messages`` returns the checkpoint's
+    messages. Sessions created after the migration but before the flag existed
+    have every turn recorded already, so nothing is added for them. Returns
+    True if this call did the backfill.
+    """
+    claimed = await sessions_collection.find_one_and_update(
+        {"session_id": session_id, "backfilled": {"$ne": True}},
+        {"$set": {"backfilled": True}},
+        {"updated_at": 1},
+    )
+    if claimed is None:
+        return False
+    try:
+        messages = await load_messages()
+        # Turns recorded since the migration are the newest ones in the checkpoint;
+        # only the older prefix is missing from the store
+        recorded = await messages_collection.count_documents(
+            {"session_id": session_id, "legacy_index": {"$exists": False}}
+        )
+        messages = messages[:max(0, len(messages) - recorded)]
+        if messages:
+            print(f"[INFO] Backfilling {len(messages)} messages for session {session_id}")
+            await backfill_from_checkpoint(
+                session_id, user_email, messages, ended_at or claimed.get("updated_at") or datetime.utcnow()
+            )
+    except Exception:
+        # Let the next request retry
+        await sessions_collection.update_one({"session_id": session_id}, {"$unset": {"backfilled": ""}})
+        raise
+    return True
+
+
+async def fetch_page(session_id: str, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Keyset-paginate a session's messages from newest to oldest. Returns
+    (messages in chronological order, cursor for the next older page or None).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"session_id": session_id}
+    if before:
+        ts, oid = decode_cursor(before)
+        try:
+            oid = ObjectId(oid)
+        except InvalidId as e:
+            raise ValueError("Invalid cursor") from e
+        query["$or"] = [{"ts": {"$lt": ts}}, {"ts": ts, "_id": {"$lt": oid}}]
+    cursor = messages_collection.find(
+        query, {"role": 1, "content": 1, "ts": 1, "response_id": 1}
+    ).sort([("ts", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]["ts"], docs[limit - 1]["_id"]) if len(docs) > limit else None
+    page = docs[:limit]
+    page.reverse()
+    return [_format(doc) for doc in page], next_cursor
+
+
+async def expire_session_messages(session_id: str, ttl_days: int = None):
+    ttl_days = settings.CHECKPOINT_HIDDEN_TTL_DAYS if ttl_days is None else ttl_days
+    await messages_collection.update_many(
+        {"session_id": session_id},
+        {"$set": {"expire_at": datetime.utcnow() + timedelta(days=ttl_days)}},
+    )
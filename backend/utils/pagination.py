@@ -0,0 +1,20 @@
+import base64
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(ts: datetime, tiebreak) -> str:
+    """Opaque keyset cursor from a timestamp plus a unique tiebreak value."""
+    # Mongo stores dates with millisecond precision, so the cursor does too.
+    raw = f"{(ts - _EPOCH) // timedelta(milliseconds=1)}:{tiebreak}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Return (ts, tiebreak string); raises ValueError when the cursor is malformed."""
+    try:
+        ts_ms, tiebreak = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        return _EPOCH + timedelta(milliseconds=int(ts_ms)), tiebreak
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
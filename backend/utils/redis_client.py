@@ -0,0 +1,14 @@
+from backend.config import settings
+
+_redis = None
+
+
+def get_redis():
+    """Shared asyncio Redis client, or None when REDIS_URL is not configured."""
+    global _redis
+    if not settings.REDIS_URL:
+        return None
+    if _redis is None:
+        import redis.asyncio as redis
+        _redis = redis.from_url(settings.REDIS_URL)
+    return _redis
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from backend.config import settings
+from backend.utils.metrics import counter
+from backend.utils.redis_client import get_redis
+
+cache_requests_counter = counter(
+    "response_cache_requests_total", "Exact-match cache lookups by cache and result (hit, shared, miss)"
+)
+
+
+class LocalResponseCache:
+    """Per-process TTL + LRU cache of JSON-serializable values."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class RedisResponseCache:
+    """Shared across workers; Redis' own eviction policy bounds its size."""
+
+    def __init__(self, redis, prefix: str, ttl: float):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = int(ttl)
+
+    async def get(self, key: str):
+        raw = await self.redis.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value):
+        await self.redis.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=self.ttl)
+
+
+class _LeaderCancelled(Exception):
+    """The caller computing a value was cancelled; waiters should compute it themselves."""
+
+
+class SingleFlightCache:
+    """
+    Cache in front of an expensive computation. Concurrent calls for the same
+    key inside one process await a single computation instead of each running it.
+    """
+
+    def __init__(self, name: str, store):
+        self.name = name
+        self.store = store
+        self._inflight = {}
+
+    async def get_or_compute(self, key: str, compute, cache_if=None):
+        """
+        Return the cached value for ``key`` or ``await compute()``. The result is
+        stored unless ``cache_if(value)`` is false. Errors are not cached; every
+        caller waiting on a failed computation gets the exception. If the caller
+        computing the value is cancelled, the waiters retry instead.
+        """
+        try:
+            value = await self.store.get(key)
+        except Exception as e:
+            print(f"[WARN] {self.name} cache read failed: {e}")
+            value = None
+        if value is not None:
+            cache_requests_counter.inc(cache=self.name, result="hit")
+            return value
+        future = self._inflight.get(key)
+        if future is not None:
+            cache_requests_counter.inc(cache=self.name, result="shared")
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # Someone else's request was cancelled (e.g. a stream client hung
+                # up); this one is still wanted, so join a new leader or become it
+                return await self.get_or_compute(key, compute, cache_if)
+        cache_requests_counter.inc(cache=self.name, result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure does not log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            self._inflight.pop(key, None)
+        if cache_if is None or cache_if(value):
+            try:
+                await self.store.set(key, value)
+            except Exception as e:
+                print(f"[WARN] {self.name} cache write failed: {e}")
+        return value
+
+
+def _create_store(prefix: str, ttl: float):
+    redis = get_redis()
+    if redis is not None:
+        return RedisResponseCache(redis, prefix, ttl)
+    return LocalResponseCache(settings.RESPONSE_CACHE_MAXSIZE, ttl)
+
+
+answer_cache = SingleFlightCache(
+    "answer", _create_store("urduwhiz:answer:", settings.RESPONSE_CACHE_TTL_SECONDS)
+) if settings.RESPONSE_CACHE_ENABLED else None
+
+# /api/chat responses by client Idempotency-Key, so a retried request is answered once
+idempotency_cache = SingleFlightCache(
+    "idempotency", _create_store("urduwhiz:idempotency:", settings.IDEMPOTENCY_TTL_SECONDS)
+)
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from pymongo import DESCENDING
+from backend.config import settings
+from backend.database import sessions_collection, checkpoints_collection, checkpoint_writes_collection
+from backend.utils.metrics import counter, gauge
+
+pruned_checkpoints_counter = counter("checkpoint_pruned_total", "Checkpoint documents deleted by retention")
+reclaimed_bytes_counter = counter("checkpoint_reclaimed_bytes_total", "BSON bytes reclaimed by checkpoint retention")
+last_run_gauge = gauge("checkpoint_compaction_last_run_timestamp", "Unix time of the last checkpoint compaction run")
+
+_last_run = None
+
+
+async def _bson_size(collection, query: dict) -> int:
+    result = await collection.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+    ]).to_list(length=1)
+    return result[0]["bytes"] if result else 0
+
+
+async def prune_thread(thread_id: str, keep: int = None) -> dict:
+    """Delete all but the newest ``keep`` checkpoints (and their writes) of one thread."""
+    keep = max(1, settings.CHECKPOINT_KEEP if keep is None else keep)
+    # checkpoint_id is a time-ordered uuid6, so a descending sort is newest first.
+    cursor = checkpoints_collection.find(
+        {"thread_id": thread_id, "checkpoint_ns": ""}, {"checkpoint_id": 1}
+    ).sort("checkpoint_id", DESCENDING).skip(keep)
+    stale_ids = [doc["checkpoint_id"] async for doc in cursor]
+    if not stale_ids:
+        return {"checkpoints": 0, "bytes": 0}
+    query = {"thread_id": thread_id, "checkpoint_ns": "", "checkpoint_id": {"$in": stale_ids}}
+    reclaimed = await _bson_size(checkpoints_collection, query) + await _bson_size(checkpoint_writes_collection, query)
+    result = await checkpoints_collection.delete_many(query)
+    await checkpoint_writes_collection.delete_many(query)
+    pruned_checkpoints_counter.inc(result.deleted_count)
+    reclaimed_bytes_counter.inc(reclaimed)
+    return {"checkpoints": result.deleted_count, "bytes": reclaimed}
+
+
+async def expire_thread(thread_id: str, ttl_days: int = None):
+    """Stamp every checkpoint of a hidden/deleted session so the TTL index removes it."""
+    ttl_days = settings.CHECKPOINT_HIDDEN_TTL_DAYS if ttl_days is None else ttl_days
+    expire_at = datetime.utcnow() + timedelta(days=ttl_days)
+    for collection in (checkpoints_collection, checkpoint_writes_collection):
+        await collection.update_many({"thread_id": thread_id}, {"$set": {"expire_at": expire_at}})
+
+
+async def run_compaction(full: bool = False) -> dict:
+    """
+    Prune every visible session touched since the previous run (or all of
+    them when ``full``). Returns totals including the bytes reclaimed.
+    """
+    global _last_run
+    started = datetime.utcnow()
+    since = None if full else _last_run
+    query = {"visible": True}
+    if since:
+        query["updated_at"] = {"$gte": since}
+    totals = {"threads": 0, "checkpoints": 0, "bytes": 0}
+    async for session in sessions_collection.find(query, {"session_id": 1}):
+        pruned = await prune_thread(session["session_id"])
+        totals["threads"] += 1
+        totals["checkpoints"] += pruned["checkpoints"]
+        totals["bytes"] += pruned["bytes"]
+    _last_run = started
+    last_run_gauge.set(time.time())
+    print(f"[INFO] Checkpoint compaction: {totals['threads']} threads, "
+          f"{totals['checkpoints']} checkpoints deleted, {totals['bytes']} bytes reclaimed")
+    return totals
+
+
+async def retention_loop():
+    """Background task started on application startup."""
+    interval = settings.CHECKPOINT_COMPACTION_INTERVAL_MINUTES * 60
+    while True:
+        try:
+            await run_compaction()
+        except Exception as e:
+            print(f"[WARN] Checkpoint compaction failed: {e}")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    # One-off full compaction: python -m backend.utils.retention
+    async def _main():
+        await run_compaction(full=True)
+
+    asyncio.run(_main())
@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from backend.utils.metrics import histogram
+
+stage_histogram = histogram("chat_stage_seconds", "Duration of each stage of the chat request path")
+
+_current_timings = ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """
+    Start offset and duration of every stage of one request. Stages that run
+    concurrently overlap in their offsets, which makes the critical path visible.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def record(self, name: str, start: float, end: float):
+        self.stages.append((name, start - self.started, end - start))
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header (durations in ms)."""
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, _, duration in self.stages)
+
+    def as_dict(self) -> dict:
+        return {
+            name: {"start_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+            for name, offset, duration in self.stages
+        }
+
+    def log(self, label: str):
+        parts = [f"{name} +{offset * 1000:.0f}ms/{duration * 1000:.0f}ms" for name, offset, duration in self.stages]
+        print(f"[INFO] {label} stages: {', '.join(parts)}")
+
+
+def begin_timings(timings: StageTimings = None) -> StageTimings:
+    """
+    Start collecting stage timings for the current request (and tasks it
+    spawns), or re-attach ``timings`` in another context such as a stream body.
+    """
+    timings = timings or StageTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block; recorded in the request's timings, if any, and the stage histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        stage_histogram.observe(end - start, stage=name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.record(name, start, end)
+
+
+async def timed(name: str, awaitable):
+    """Await ``awaitable`` inside stage(name); handy as an asyncio.gather argument."""
+    with stage(name):
+        return await awaitable
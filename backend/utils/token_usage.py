@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+from backend.database import token_usage_collection
+
+GROUP_FIELDS = {"session": "session_id", "collection": "collection_name", "user": "user_email", "day": None}
+MAX_GROUPS = 200
+
+_tasks = set()
+
+
+def record_usage(record: dict):
+    """
+    Store one chat answer's token usage without holding up the response.
+    Called by the RAG node with session, user, collection and token counts.
+    """
+    doc = {**record, "total_tokens": record.get("input_tokens", 0) + record.get("output_tokens", 0),
+           "ts": datetime.utcnow()}
+    task = asyncio.create_task(_insert(doc))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _insert(doc: dict):
+    try:
+        await token_usage_collection.insert_one(doc)
+    except Exception as e:
+        print(f"[WARN] Failed to record token usage: {e}")
+
+
+async def usage_summary(user_email: str = None, group_by: str = "session", since: datetime = None, limit: int = 50) -> list:
+    """
+    Token totals for chat answers grouped by session, collection, user or day,
+    most expensive first. Limited to one user unless ``user_email`` is None
+    (admin view across all users).
+    """
+    match = {"user_email": user_email} if user_email else {}
+    if since:
+        match["ts"] = {"$gte": since}
+    field = GROUP_FIELDS[group_by]
+    key = f"${field}" if field else {"$dateToString": {"format": "%Y-%m-%d", "date": "$ts"}}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": key,
+            "requests": {"$sum": 1},
+            "input_tokens": {"$sum": "$input_tokens"},
+            "output_tokens": {"$sum": "$output_tokens"},
+            "total_tokens": {"$sum": "$total_tokens"},
+            "estimated_prompt_tokens": {"$sum": "$estimated_prompt_tokens"},
+            "last_used_at": {"$max": "$ts"},
+        }},
+        {"$sort": {"total_tokens": -1}},
+        {"$limit": max(1, min(limit, MAX_GROUPS))},
+    ]
+    groups = await token_usage_collection.aggregate(pipeline).to_list(length=None)
+    return [
+        {
+            group_by: group.pop("_id"),
+            **group,
+            "last_used_at": group["last_used_at"].isoformat() if group.get("last_used_at") else None,
+        }
+        for group in groups
+    ]
@@ -0,0 +1,81 @@
+import hashlib
+import fitz  # PyMuPDF
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+PDF_MAGIC = b"%PDF-"
+# Multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject an oversized upload from its Content-Length header before any of
+    the body is read. Starlette spools the whole multipart body before the
+    endpoint runs, so a limit checked in the endpoint only bounds processing.
+    Chunked uploads without a Content-Length fall through to the endpoint.
+    """
+
+    def __init__(self, app, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == self.path:
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            if length.isdigit() and int(length) > self.max_bytes + MULTIPART_OVERHEAD_BYTES:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"PDF exceeds the maximum upload size of {self.max_bytes // (1024 * 1024)} MB"},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+async def stream_upload_to_disk(file: UploadFile, dest, max_bytes: int, chunk_size: int = 1024 * 1024):
+    """
+    Copy an upload to ``dest`` (an open binary file) in fixed-size chunks,
+    rejecting it as soon as it is not a PDF or grows past ``max_bytes``.
+    Returns (size in bytes, SHA-256 hex digest computed while streaming).
+    By now Starlette has already received the body, so this limit bounds
+    processing; UploadSizeLimitMiddleware rejects large bodies on receipt.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if len(head) < len(PDF_MAGIC):
+            head += chunk[:len(PDF_MAGIC) - len(head)]
+            if len(head) == len(PDF_MAGIC) and head != PDF_MAGIC:
+                raise HTTPException(status_code=400, detail="File is not a valid PDF")
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"PDF exceeds the maximum upload size of {max_bytes // (1024 * 1024)} MB",
+            )
+        digest.update(chunk)
+        dest.write(chunk)
+    if head != PDF_MAGIC:
+        raise HTTPException(status_code=400, detail="File is not a valid PDF")
+    dest.flush()
+    return size, digest.hexdigest()
+
+
+def validate_pdf_pages(path: str, max_pages: int) -> int:
+    """Open the PDF's structure only (no rendering) and enforce the page limit."""
+    try:
+        with fitz.open(path) as pdf:
+            page_count = pdf.page_count
+    except Exception:
+        raise HTTPException(status_code=400, detail="PDF is corrupted or unreadable")
+    if page_count == 0:
+        raise HTTPException(status_code=400, detail="PDF has no pages")
+    if page_count > max_pages:
+        raise HTTPException(status_code=400, detail=f"PDF has {page_count} pages; the limit is {max_pages}")
+    return page_count
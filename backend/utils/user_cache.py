@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from bson import json_util
+from backend.config import settings
+from backend.database import users_collection
+from backend.utils.metrics import counter, gauge
+from backend.utils.redis_client import get_redis
+
+cache_hits_counter = counter("user_cache_hits_total", "Authenticated-user lookups served from cache")
+cache_misses_counter = counter("user_cache_misses_total", "Authenticated-user lookups that went to MongoDB")
+cache_invalidations_counter = counter("user_cache_invalidations_total", "User cache entries invalidated")
+cache_hit_ratio_gauge = gauge("user_cache_hit_ratio", "Share of user lookups served from cache")
+
+# Credentials never enter the cache (it may be a shared Redis); login reads them directly
+CACHED_USER_PROJECTION = {"hashed_password": 0}
+
+
+class LocalUserCache:
+    """Per-process TTL + LRU cache of user documents keyed by JWT subject."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return dict(user)
+
+    async def set(self, key: str, user: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, dict(user))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+class RedisUserCache:
+    """Shared cache so an invalidation in one worker is seen by all of them."""
+
+    prefix = "urduwhiz:user:"
+
+    def __init__(self, redis, ttl: float):
+        self.redis = redis
+        self.ttl = int(ttl)
+
+    async def get(self, key: str):
+        raw = await self.redis.get(self.prefix + key)
+        return json_util.loads(raw) if raw else None
+
+    async def set(self, key: str, user: dict):
+        await self.redis.set(self.prefix + key, json_util.dumps(user), ex=self.ttl)
+
+    async def delete(self, key: str):
+        await self.redis.delete(self.prefix + key)
+
+
+def _create_cache():
+    redis = get_redis()
+    if redis is not None:
+        return RedisUserCache(redis, settings.USER_CACHE_TTL_SECONDS)
+    return LocalUserCache(settings.USER_CACHE_MAXSIZE, settings.USER_CACHE_TTL_SECONDS)
+
+
+user_cache = _create_cache()
+
+
+def _record(hit: bool):
+    (cache_hits_counter if hit else cache_misses_counter).inc()
+    hits, misses = cache_hits_counter.value(), cache_misses_counter.value()
+    cache_hit_ratio_gauge.set(hits / (hits + misses))
+
+
+async def get_cached_user(email: str):
+    """
+    Return the user for a token subject, hitting MongoDB only on a cache miss.
+    The document excludes ``hashed_password``.
+    """
+    try:
+        user = await user_cache.get(email)
+    except Exception as e:
+        print(f"[WARN] User cache read failed: {e}")
+        user = None
+    if user is not None:
+        _record(hit=True)
+        return user
+    _record(hit=False)
+    user = await users_collection.find_one({"email": email}, CACHED_USER_PROJECTION)
+    if user is not None:
+        try:
+            await user_cache.set(email, user)
+        except Exception as e:
+            print(f"[WARN] User cache write failed: {e}")
+    return user
+
+
+async def invalidate_user(email: str):
+    """Drop a cached user after any change to their record (password, verification, profile)."""
+    cache_invalidations_counter.inc()
+    try:
+        await user_cache.delete(email)
+    except Exception as e:
+        print(f"[WARN] User cache invalidation failed: {e}")
@@ -0,0 +1,208 @@
+"""
+Portable bundles of processed books, so a book that has been OCR'd,
+chunked and embedded can be moved or restored without re-running the
+pipeline.
+
+    python -m book_bundle export <collection_name> book.parquet
+    python -m book_bundle import book.parquet [--collection NAME] [--owner EMAIL] [--replace]
+
+A bundle is one Parquet file with a row per Qdrant point (id, page_content,
+JSON payload with summary/keywords/chunk metadata, float32 vector) and the
+book's registry entry, FAQ/glossary and embedding model in the file's
+schema metadata. Import uploads the vectors as-is, so it makes no model or
+Gemini calls, and refuses bundles embedded with a different model.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, VectorParams
+from model_server import EMBEDDING_MODEL_NAME
+
+BUNDLE_FORMAT_VERSION = 1
+VECTOR_SIZE = 512
+SCROLL_PAGE_SIZE = 512
+UPLOAD_BATCH_SIZE = 256
+UPLOAD_PARALLEL = int(os.getenv("BUNDLE_UPLOAD_PARALLEL", "2"))
+PAYLOAD_INDEX_FIELDS = ("keywords", "summary", "type")
+
+
+def get_client() -> QdrantClient:
+    return QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"), timeout=120)
+
+
+def _mongo_doc(doc: dict):
+    """Registry/FAQ document as JSON-safe values, without the Mongo _id."""
+    if not doc:
+        return None
+    doc = {k: v for k, v in doc.items() if k != "_id"}
+    return json.loads(json.dumps(doc, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)))
+
+
+def _restore_dates(doc: dict, *fields) -> dict:
+    for field in fields:
+        if isinstance(doc.get(field), str):
+            doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+
+def export_book(collection_name: str, path: str, registry: dict = None, book_faq: dict = None) -> int:
+    """Write every point of ``collection_name`` to a Parquet bundle; returns the point count."""
+    client = get_client()
+    ids, texts, payloads, vectors = [], [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=SCROLL_PAGE_SIZE, offset=offset,
+            with_payload=True, with_vectors=True,
+        )
+        for point in points:
+            payload = dict(point.payload or {})
+            ids.append(str(point.id))
+            texts.append(payload.pop("page_content", ""))
+            payloads.append(payload)
+            vectors.append(point.vector)
+        if offset is None:
+            break
+    if not ids:
+        raise ValueError(f"Collection '{collection_name}' is empty or does not exist.")
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    summary = next((p.get("summary") for p in payloads if p.get("type") == "summary"), None)
+    keywords = next((p["keywords"] for p in payloads if p.get("keywords")), [])
+    metadata = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "collection_name": collection_name,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "vector_size": matrix.shape[1],
+        "points": len(ids),
+        "summary": summary,
+        "keywords": keywords,
+        "registry": _mongo_doc(registry),
+        "book_faq": _mongo_doc(book_faq),
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    table = pa.table({
+        "id": pa.array(ids, pa.string()),
+        "page_content": pa.array(texts, pa.string()),
+        "payload": pa.array([json.dumps(p, ensure_ascii=False) for p in payloads], pa.string()),
+        "vector": pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel(), pa.float32()), matrix.shape[1]),
+    }).replace_schema_metadata({"urduwhiz_bundle": json.dumps(metadata, ensure_ascii=False)})
+    pq.write_table(table, path, compression="zstd")
+    print(f"[INFO] Exported {len(ids)} points from '{collection_name}' to {path}")
+    return len(ids)
+
+
+def read_bundle(path: str):
+    """Return (metadata, table) after checking the bundle's format and embedding model."""
+    table = pq.read_table(path)
+    raw = (table.schema.metadata or {}).get(b"urduwhiz_bundle")
+    if raw is None:
+        raise ValueError(f"{path} is not an UrduWhiz book bundle.")
+    metadata = json.loads(raw)
+    if metadata["format_version"] > BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Bundle format {metadata['format_version']} is newer than supported ({BUNDLE_FORMAT_VERSION}).")
+    if metadata["embedding_model"] != EMBEDDING_MODEL_NAME or metadata["vector_size"] != VECTOR_SIZE:
+        raise ValueError(
+            f"Bundle was embedded with {metadata['embedding_model']} ({metadata['vector_size']} dims); "
+            f"this deployment uses {EMBEDDING_MODEL_NAME} ({VECTOR_SIZE} dims). Re-ingest the book instead."
+        )
+    if table.num_rows != metadata["points"]:
+        raise ValueError(f"Bundle has {table.num_rows} rows but its metadata records {metadata['points']}.")
+    return metadata, table
+
+
+def _ensure_collection(client: QdrantClient, collection_name: str, replace: bool):
+    if client.collection_exists(collection_name):
+        if not replace and client.count(collection_name, exact=False).count:
+            raise ValueError(f"Collection '{collection_name}' already has points; pass --replace to overwrite it.")
+        client.delete_collection(collection_name)
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
+    )
+    # Same payload indexes as create_vector_db
+    for field in PAYLOAD_INDEX_FIELDS:
+        client.create_payload_index(collection_name=collection_name, field_name=field, field_schema="keyword")
+
+
+def import_book(path: str, collection_name: str = None, replace: bool = False) -> dict:
+    """Load a bundle into Qdrant; returns the bundle metadata with the collection name used."""
+    metadata, table = read_bundle(path)
+    collection_name = collection_name or metadata["collection_name"]
+    client = get_client()
+    _ensure_collection(client, collection_name, replace)
+
+    # Zero-copy view of the fixed-size list column as an (n, dim) float32 matrix
+    vectors = table.column("vector").combine_chunks().values.to_numpy().reshape(-1, metadata["vector_size"])
+    payloads = [
+        {**json.loads(payload), "page_content": text}
+        for payload, text in zip(table.column("payload").to_pylist(), table.column("page_content").to_pylist())
+    ]
+    client.upload_collection(
+        collection_name=collection_name,
+        vectors=vectors,
+        payload=payloads,
+        ids=table.column("id").to_pylist(),
+        batch_size=UPLOAD_BATCH_SIZE,
+        parallel=UPLOAD_PARALLEL,
+        wait=True,
+    )
+    print(f"[INFO] Imported {table.num_rows} points into '{collection_name}'")
+    return {**metadata, "collection_name": collection_name}
+
+
+async def _export(args):
+    from backend.database import books_collection, book_faq_collection
+    registry, book_faq = await asyncio.gather(
+        books_collection.find_one({"collection_name": args.collection_name}),
+        book_faq_collection.find_one({"collection_name": args.collection_name}),
+    )
+    await asyncio.to_thread(export_book, args.collection_name, args.path, registry, book_faq)
+
+
+async def _import(args):
+    from backend.database import books_collection
+    from backend.utils.faq import save_book_faq
+    metadata = await asyncio.to_thread(import_book, args.path, args.collection, args.replace)
+    collection_name = metadata["collection_name"]
+    registry = _restore_dates(dict(metadata.get("registry") or {}), "created_at")
+    owner = args.owner or registry.get("user_email")
+    if owner:
+        registry.update({"collection_name": collection_name, "user_email": owner, "imported_at": datetime.utcnow()})
+        registry.setdefault("created_at", datetime.utcnow())
+        await books_collection.update_one({"collection_name": collection_name}, {"$set": registry}, upsert=True)
+    else:
+        print("[WARN] Bundle has no owner; pass --owner to register the book for a user.")
+    book_faq = metadata.get("book_faq")
+    if book_faq:
+        await save_book_faq(collection_name, {"faq": book_faq.get("faq", []), "glossary": book_faq.get("glossary", [])})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m book_bundle", description="Export/import processed books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a Qdrant collection to a bundle")
+    export_parser.add_argument("collection_name")
+    export_parser.add_argument("path")
+    import_parser = commands.add_parser("import", help="load a bundle into Qdrant")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--collection", help="collection name to import into (default: the original)")
+    import_parser.add_argument("--owner", help="email to register the book for (default: the original owner)")
+    import_parser.add_argument("--replace", action="store_true", help="overwrite an existing non-empty collection")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_export(args) if args.command == "export" else _import(args))
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
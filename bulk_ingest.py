@@ -0,0 +1,261 @@
+"""
+Offline bulk ingestion of many PDFs into Qdrant, for seeding a catalogue.
+
+    python -m bulk_ingest books/ --owner teacher@example.com --report ingest.jsonl
+    python -m bulk_ingest manifest.txt --owner teacher@example.com --workers 4
+
+The source is a directory (searched recursively for *.pdf) or a manifest
+file with one path per line (or JSON lines with a "path" key). Files whose
+SHA-256 is already in the Books registry, or repeated within the run, are
+skipped. Rasterization and embedding run in a process pool; OCR uses the
+engines chosen by --ocr-policy (Gemini and/or local Tesseract), and
+summaries and the FAQ go through the shared LLM gateway at ingestion
+priority.
+
+Memory stays bounded: at most --max-inflight books are processed at once,
+pages are rendered to JPEG files on disk rather than held in memory, Gemini
+OCR sends --ocr-pages-per-call pages per request, and each pool worker loads
+one embedding model (none when MODEL_SERVER_SOCKET points at the model
+server).
+
+One JSON line per file is appended to --report with its status, content
+hash, collection, counts, per-stage timings and per-page OCR engine and
+confidence.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+# --- POOL WORKERS (keep imports light: they run in fresh processes) ---
+_worker_embeddings = None
+
+
+def _get_worker_embeddings():
+    global _worker_embeddings
+    if _worker_embeddings is None:
+        from model_server import EMBEDDING_MODEL_NAME, ModelClient, RemoteEmbeddings
+        socket_path = os.getenv("MODEL_SERVER_SOCKET")
+        if socket_path:
+            _worker_embeddings = RemoteEmbeddings(ModelClient(socket_path))
+        else:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            _worker_embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    return _worker_embeddings
+
+
+def rasterize_pdf(pdf_path: str, output_dir: str, dpi: int) -> list:
+    """Render every page to a JPEG in ``output_dir``; returns the image paths."""
+    import fitz  # PyMuPDF
+    paths = []
+    with fitz.open(pdf_path) as pdf:
+        for i, page in enumerate(pdf):
+            path = os.path.join(output_dir, f"page_{i + 1}.jpg")
+            page.get_pixmap(dpi=dpi).save(path)
+            paths.append(path)
+    return paths
+
+
+def count_pages(pdf_path: str) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as pdf:
+        return len(pdf)
+
+
+def embed_texts(texts: list) -> list:
+    return _get_worker_embeddings().embed_documents(texts)
+
+
+# --- MAIN PROCESS ---
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def discover_pdfs(source: str) -> list:
+    """PDF paths from a directory (recursive) or a manifest file."""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names if name.lower().endswith(".pdf")
+        )
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return paths
+
+
+async def ingest_file(path: str, args, pool, rag, seen_hashes: set) -> dict:
+    """Ingest one PDF; returns its report record."""
+    from backend.database import books_collection
+    from backend.utils.faq import save_book_faq
+    from backend.utils.timing import begin_timings, stage
+
+    loop = asyncio.get_running_loop()
+    timings = begin_timings()
+    report = {"path": path, "status": "ingested"}
+    faq_task = None
+    try:
+        with stage("hash"):
+            content_sha256 = await loop.run_in_executor(None, sha256_file, path)
+        report["sha256"] = content_sha256
+        if content_sha256 in seen_hashes:
+            report["status"] = "skipped"
+            report["reason"] = "duplicate in this run"
+            return report
+        seen_hashes.add(content_sha256)
+        existing = await books_collection.find_one({"sha256": content_sha256}, {"collection_name": 1})
+        if existing:
+            report["status"] = "skipped"
+            report["reason"] = "already ingested"
+            report["collection_name"] = existing["collection_name"]
+            return report
+
+        filename = os.path.basename(path)
+        collection_name = f"{os.path.splitext(filename)[0]}-{str(uuid.uuid4())[:7]}"
+        # Check the page count before rendering anything
+        page_count = await loop.run_in_executor(None, count_pages, path)
+        report["pages"] = page_count
+        if page_count > args.max_pages:
+            raise ValueError(f"{page_count} pages exceeds --max-pages {args.max_pages}")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with stage("rasterize"):
+                image_files = await loop.run_in_executor(pool, rasterize_pdf, path, temp_dir, args.dpi)
+
+            ocr_instruction = "Extract all Urdu text content accurately from the scanned pages."
+            with stage("ocr"):
+                extracted_text, ocr_report = await rag.ocr_router.extract_text(
+                    image_files, ocr_instruction, policy=args.ocr_policy, pages_per_call=args.ocr_pages_per_call
+                )
+        report["ocr"] = ocr_report
+        if not extracted_text:
+            raise ValueError("OCR returned no text")
+
+        with stage("summarize"):
+            faq_task = asyncio.create_task(rag.generate_book_faq(extracted_text)) if args.faq else None
+            summary, keywords = await rag.summarize_and_extract_keywords(extracted_text)
+
+        text_chunks = rag.chunk_extracted_text(extracted_text)
+        for i, doc in enumerate(text_chunks):
+            doc.metadata = {"source_pdf": filename, "summary": summary, "keywords": keywords,
+                            "chunk_index": i, "content_sha256": content_sha256}
+        text_chunks.append(rag.Document(
+            page_content=summary,
+            metadata={"source_pdf": filename, "type": "summary", "keywords": keywords, "summary": summary,
+                      "chunk_index": -1, "content_sha256": content_sha256},
+        ))
+        valid_documents = [doc for doc in text_chunks if doc.page_content]
+        texts = [doc.page_content for doc in valid_documents]
+        metadatas = [doc.metadata for doc in valid_documents]
+        report["chunks"] = len(texts)
+
+        with stage("embed"):
+            vectors = await loop.run_in_executor(pool, embed_texts, texts)
+        with stage("upsert"):
+            await loop.run_in_executor(None, rag.create_vector_db, collection_name, texts, metadatas, vectors)
+
+        if faq_task is not None:
+            with stage("faq"):
+                try:
+                    await save_book_faq(collection_name, await faq_task)
+                except Exception as e:
+                    print(f"[WARN] Book FAQ generation failed for {filename}: {e}")
+        await books_collection.insert_one({
+            "collection_name": collection_name,
+            "user_email": args.owner,
+            "filename": filename,
+            "sha256": content_sha256,
+            "size_bytes": os.path.getsize(path),
+            "page_count": page_count,
+            "ocr": {k: ocr_report[k] for k in ("policy", "engine_pages", "mean_local_confidence", "pages_per_second")},
+            "created_at": datetime.utcnow(),
+            "source": "bulk_ingest",
+        })
+        report["collection_name"] = collection_name
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if faq_task is not None and not faq_task.done():
+            faq_task.cancel()
+        report["timings"] = timings.as_dict()
+        report["total_seconds"] = round(time.perf_counter() - timings.started, 3)
+    return report
+
+
+async def run(args) -> dict:
+    # Only the main process imports advance_rag; its embedding and reranker
+    # models load lazily and this CLI never asks for them (the pool embeds)
+    import advance_rag as rag
+    from backend.utils.indexes import ensure_indexes
+
+    await ensure_indexes()
+    paths = discover_pdfs(args.source)
+    print(f"[INFO] {len(paths)} PDFs to ingest with {args.workers} workers, {args.max_inflight} in flight")
+    counts = {"ingested": 0, "skipped": 0, "failed": 0}
+    seen_hashes = set()
+    inflight = asyncio.Semaphore(args.max_inflight)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool, \
+            open(args.report, "a", encoding="utf-8") as report_file:
+
+        async def worker(path):
+            async with inflight:
+                report = await ingest_file(path, args, pool, rag, seen_hashes)
+            counts[report["status"]] += 1
+            report_file.write(json.dumps(report, ensure_ascii=False) + "\n")
+            report_file.flush()
+            print(f"[INFO] {report['status']}: {path} ({report['total_seconds']}s)"
+                  + (f" - {report['error']}" if report.get("error") else ""))
+
+        try:
+            await asyncio.gather(*(worker(path) for path in paths))
+        finally:
+            rag.ocr_router.close()
+    print(f"[INFO] Done: {counts['ingested']} ingested, {counts['skipped']} skipped, "
+          f"{counts['failed']} failed. Report: {args.report}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bulk_ingest", description="Bulk-ingest PDFs into UrduWhiz")
+    parser.add_argument("source", help="directory of PDFs or a manifest file")
+    parser.add_argument("--owner", required=True, help="email of the user the books are registered to")
+    parser.add_argument("--report", default="ingest_report.jsonl", help="JSON-lines report (appended)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="processes for rasterization and embedding")
+    parser.add_argument("--max-inflight", type=int, default=2, help="books processed at the same time")
+    parser.add_argument("--ocr-pages-per-call", type=int, default=10)
+    parser.add_argument("--ocr-policy", choices=("gemini", "local", "local-first", "gemini-first"),
+                        help="OCR engine policy (default: OCR_POLICY)")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--max-pages", type=int, default=500)
+    parser.add_argument("--no-faq", dest="faq", action="store_false", help="skip FAQ/glossary generation")
+    args = parser.parse_args(argv)
+    counts = asyncio.run(run(args))
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
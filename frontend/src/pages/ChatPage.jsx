@@ -149,8 +149,17 @@ const ChatPage = () => {
       
       // Try to get messages, but don't fail if they don't exist
       try {
-        const messagesResponse = await authAxios.get(`/api/sessions/${sessionId}/messages`);
-        setMessages(messagesResponse.data || []);
+        // Messages come back newest page first; follow X-Next-Cursor back to the start
+        let history = [];
+        let before = null;
+        do {
+          const messagesResponse = await authAxios.get(`/api/sessions/${sessionId}/messages`, {
+            params: { limit: 200, ...(before ? { before } : {}) }
+          });
+          history = [...(messagesResponse.data || []), ...history];
+          before = messagesResponse.headers["x-next-cursor"] || null;
+        } while (before);
+        setMessages(history);
       } catch (messagesError) {
         setMessages([]);
       }
@@ -0,0 +1,135 @@
+"""
+Cheap local check run before retrieval: is this question Urdu? English and
+Roman Urdu questions get the same refusal the prompt asks Gemini to give,
+and empty or garbage input is turned away, without a Qdrant or LLM call.
+
+    python -m language_gate     # check the corpus and time the classifier
+"""
+import re
+import sys
+import timeit
+from backend.utils.metrics import counter
+
+URDU_ONLY_REFUSAL = "میں صرف اردو زبان میں سوالات کا جواب دے سکتا ہوں۔ براہ کرم اردو میں لکھیں۔"
+EMPTY_QUERY_REFUSAL = "براہ کرم اردو میں اپنا سوال لکھیں۔"
+
+# Share of letters that must be Arabic-script for a question to count as Urdu.
+# Below 1 so Urdu questions may mention "PDF" or an English name.
+URDU_MIN_SCRIPT_RATIO = 0.5
+# Share of Latin-script tokens that must be Roman Urdu function words.
+ROMAN_URDU_MIN_RATIO = 0.25
+# Only the head of very long inputs is inspected.
+MAX_SCAN_CHARS = 512
+
+ROMAN_URDU_WORDS = frozenset("""
+    aap ap apna apni aur bhi batao btao bataen batain batayen btaen hai hain hay hy ho hoa hua hui
+    kahani kahan kaha kaisa kaise kaisi kar karo karta karti kia kya kyu kyun kyon kis kisne kon kaun
+    ka ke ki ko liye mein mai mujhe mjhe nahi nahin nhi se tha thi thay tum tha wala wali woh wo yeh ye
+    jab tak phir kab kitna kitne kitni matlab samjhao likho
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+gate_counter = counter("language_gate_total", "Chat questions classified by the local language gate")
+
+
+def _is_arabic_script(code: int) -> bool:
+    return (0x0600 <= code <= 0x06FF or 0x0750 <= code <= 0x077F
+            or 0xFB50 <= code <= 0xFDFF or 0xFE70 <= code <= 0xFEFF)
+
+
+def classify_query(query: str) -> str:
+    """
+    Label a question as "urdu", "roman_urdu", "english", "other", "empty" or
+    "garbage" from its Unicode script mix and, for Latin text, the share of
+    Roman Urdu function words.
+    """
+    text = (query or "").strip()[:MAX_SCAN_CHARS]
+    if not text:
+        return "empty"
+    arabic = latin = other = 0
+    letters = set()
+    for ch in text:
+        if not ch.isalpha():
+            continue
+        letters.add(ch)
+        code = ord(ch)
+        if _is_arabic_script(code):
+            arabic += 1
+        elif code < 0x0250:
+            latin += 1
+        else:
+            other += 1
+    total = arabic + latin + other
+    # No letters at all (digits, punctuation, emoji) or one key held down
+    if total == 0 or (total >= 4 and len(letters) <= 2):
+        return "garbage"
+    if arabic / total >= URDU_MIN_SCRIPT_RATIO:
+        return "urdu"
+    if latin >= other:
+        tokens = _TOKEN_RE.findall(text.lower())
+        roman = sum(1 for token in tokens if token in ROMAN_URDU_WORDS)
+        if tokens and roman / len(tokens) >= ROMAN_URDU_MIN_RATIO:
+            return "roman_urdu"
+        return "english"
+    return "other"
+
+
+def gate_query(query: str):
+    """Return the refusal to send instead of answering, or None if the question may proceed."""
+    label = classify_query(query)
+    gate_counter.inc(label=label)
+    if label == "urdu":
+        return None
+    if label in ("empty", "garbage"):
+        return EMPTY_QUERY_REFUSAL
+    return URDU_ONLY_REFUSAL
+
+
+# (question, expected label) pairs checked by ``python -m language_gate``
+CORPUS = [
+    ("کہانی کا مرکزی خیال کیا ہے؟", "urdu"),
+    ("اس کہانی میں کتنے کردار ہیں", "urdu"),
+    ("خوشی کا مطلب کیا ہے؟", "urdu"),
+    ("PDF کا خلاصہ بتائیں", "urdu"),
+    ("علی نے Ahmed کو کیا کہا؟", "urdu"),
+    ("  بادشاہ کہاں رہتا تھا؟  ", "urdu"),
+    ("ﻛﮩﺎﻧﯽ", "urdu"),
+    ("What is the main idea of the story?", "english"),
+    ("Who is the king in this book", "english"),
+    ("summary please", "english"),
+    ("kahani ka markazi khayal kya hai?", "roman_urdu"),
+    ("is kahani mein kitne kirdar hain", "roman_urdu"),
+    ("mujhe summary batao", "roman_urdu"),
+    ("badshah kahan rehta tha", "roman_urdu"),
+    ("Какова главная идея?", "other"),
+    ("这个故事讲的是什么", "other"),
+    ("", "empty"),
+    ("   \n\t ", "empty"),
+    ("???", "garbage"),
+    ("12345 !!!", "garbage"),
+    ("😀😀😀", "garbage"),
+    ("aaaaaaaa", "garbage"),
+    ("ہہہہہہہہ", "garbage"),
+]
+
+
+def check_corpus():
+    """Return the corpus entries the classifier gets wrong as (query, expected, actual)."""
+    return [(query, expected, classify_query(query)) for query, expected in CORPUS
+            if classify_query(query) != expected]
+
+
+if __name__ == "__main__":
+    failures = check_corpus()
+    for query, expected, actual in failures:
+        print(f"[ERROR] {query!r}: expected {expected}, got {actual}")
+    print(f"[INFO] Corpus: {len(CORPUS) - len(failures)}/{len(CORPUS)} classified correctly")
+
+    long_query = "اس کہانی میں بادشاہ نے اپنے وزیر سے کیا کہا اور کیوں؟ " * 20
+    for name, query in [("short urdu", CORPUS[0][0]), ("roman urdu", CORPUS[10][0]),
+                        ("english", CORPUS[7][0]), ("long urdu", long_query)]:
+        runs = 20000
+        seconds = timeit.timeit(lambda: classify_query(query), number=runs)
+        print(f"[INFO] {name:>10}: {seconds / runs * 1e6:.2f} us per call")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,279 @@
+"""
+One shared entry point for every Gemini call (chat answers, history
+summaries, OCR, ingestion summaries):
+
+- a priority queue, so interactive chat is admitted ahead of ingestion;
+- an AIMD concurrency limit: +1/limit per fast success, halved on a 429 or
+  timeout (at most once per cooldown), nudged down when chat latency is
+  over the SLO;
+- per-call timeouts and optional hedging: if an attempt is still running
+  after ``hedge_after`` seconds and there is spare capacity, a second
+  attempt is started and the first result wins;
+- a lighter fallback model while under pressure (recent 429/timeouts or
+  chat latency over the SLO), and as a one-off retry after a 429/timeout
+  (not for streamed calls, whose first attempt may have sent tokens);
+- model clients created once per model name instead of per call.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from backend.utils.metrics import counter, gauge, histogram
+
+PRIORITY_CHAT = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_INGEST = 2
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_BACKGROUND: "background", PRIORITY_INGEST: "ingest"}
+
+llm_requests_counter = counter("llm_requests_total", "Gemini calls by model, priority and outcome")
+llm_latency_histogram = histogram(
+    "llm_latency_seconds", "Gemini call latency by model and priority",
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300),
+)
+llm_queue_histogram = histogram("llm_queue_seconds", "Time a Gemini call waited for a concurrency slot")
+llm_limit_gauge = gauge("llm_concurrency_limit", "Current adaptive Gemini concurrency limit")
+llm_inflight_gauge = gauge("llm_inflight", "Gemini calls currently running")
+llm_waiting_gauge = gauge("llm_waiting", "Gemini calls waiting for a slot")
+llm_hedges_counter = counter("llm_hedged_requests_total", "Hedged second attempts started")
+llm_fallbacks_counter = counter("llm_fallback_requests_total", "Calls routed to the fallback model, by reason")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for quota/429 errors from either Gemini SDK."""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "ResourceExhausted" in text or "RESOURCE_EXHAUSTED" in text
+
+
+class AIMDLimiter:
+    """Priority-ordered concurrency limiter whose limit adapts to overload signals."""
+
+    def __init__(self, initial: float, minimum: int, maximum: int,
+                 decrease_factor: float = 0.5, cooldown: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.inflight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        llm_limit_gauge.set(self.limit)
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < max(self.minimum, int(self.limit))
+
+    async def acquire(self, priority: int):
+        if self._has_capacity() and not self._waiters:
+            self._take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        llm_waiting_gauge.set(len(self._waiters))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted a slot just as we were cancelled: give it back
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now (used for hedges)."""
+        if self._has_capacity() and not self._waiters:
+            self._take()
+            return True
+        return False
+
+    def release(self):
+        self.inflight -= 1
+        llm_inflight_gauge.set(self.inflight)
+        self._wake()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        llm_limit_gauge.set(self.limit)
+        self._wake()
+
+    def on_overload(self, factor: float = None):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * (factor or self.decrease_factor))
+        llm_limit_gauge.set(self.limit)
+
+    def _take(self):
+        self.inflight += 1
+        llm_inflight_gauge.set(self.inflight)
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._take()
+            future.set_result(None)
+        llm_waiting_gauge.set(len(self._waiters))
+
+
+class LLMGateway:
+    """Schedules Gemini calls; see the module docstring."""
+
+    def __init__(self, model_name: str, fallback_model_name: str = None, api_key: str = None, *,
+                 initial_concurrency: int = 4, min_concurrency: int = 1, max_concurrency: int = 16,
+                 timeout: float = 60.0, latency_slo: float = 8.0, hedge_after: float = 0.0,
+                 pressure_window: float = 30.0):
+        self.model_name = model_name
+        self.fallback_model_name = fallback_model_name
+        self.api_key = api_key
+        self.timeout = timeout
+        self.latency_slo = latency_slo
+        self.hedge_after = hedge_after
+        self.pressure_window = pressure_window
+        self.limiter = AIMDLimiter(initial_concurrency, min_concurrency, max_concurrency)
+        self._chat_models = {}
+        self._generative_models = {}
+        self._configured = False
+        self._chat_latency = None
+        self._chat_latency_at = float("-inf")
+        self._last_overload = float("-inf")
+
+    def _require_key(self):
+        if not self.api_key:
+            raise EnvironmentError("GEMINI_API_KEY not found in environment variables.")
+
+    def chat_model(self, name: str = None):
+        """Cached LangChain chat model for ``name`` (the primary model by default)."""
+        name = name or self.model_name
+        if name not in self._chat_models:
+            self._require_key()
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            self._chat_models[name] = ChatGoogleGenerativeAI(model=name, google_api_key=self.api_key)
+        return self._chat_models[name]
+
+    def generative_model(self, name: str = None):
+        """Cached google.generativeai model for multimodal (OCR) calls; configure() runs once."""
+        name = name or self.model_name
+        if name not in self._generative_models:
+            self._require_key()
+            from google.generativeai import configure, GenerativeModel
+            if not self._configured:
+                configure(api_key=self.api_key)
+                self._configured = True
+            self._generative_models[name] = GenerativeModel(name)
+        return self._generative_models[name]
+
+    def _recent_chat_latency(self):
+        """Chat latency EWMA, or None once no chat call has finished for ``pressure_window``."""
+        if time.monotonic() - self._chat_latency_at > self.pressure_window:
+            return None
+        return self._chat_latency
+
+    def under_pressure(self) -> bool:
+        if time.monotonic() - self._last_overload < self.pressure_window:
+            return True
+        latency = self._recent_chat_latency()
+        return latency is not None and latency > self.latency_slo
+
+    async def ainvoke(self, prompt, priority: int = PRIORITY_CHAT, **kwargs):
+        """Chat completion through the gateway; returns the model's AIMessage."""
+        return await self.run(lambda name: self.chat_model(name).ainvoke(prompt), priority, **kwargs)
+
+    async def generate_content(self, parts, priority: int = PRIORITY_INGEST, **kwargs):
+        """Multimodal generate_content through the gateway."""
+        return await self.run(lambda name: self.generative_model(name).generate_content_async(parts), priority, **kwargs)
+
+    async def run(self, call, priority: int = PRIORITY_CHAT, timeout: float = None,
+                  hedge: bool = False, allow_fallback: bool = True, retry: bool = True):
+        """
+        Run ``call(model_name)`` (a coroutine factory) under the scheduler.
+        The model is the primary one unless the gateway is under pressure, in
+        which case the fallback model is used when ``allow_fallback``. After a
+        429/timeout the call is retried once on the fallback model unless
+        ``retry`` is False, which streamed calls need: the failed attempt may
+        already have sent tokens to the client.
+        """
+        use_fallback = allow_fallback and self.fallback_model_name and self.under_pressure()
+        model_name = self.fallback_model_name if use_fallback else self.model_name
+        if use_fallback:
+            llm_fallbacks_counter.inc(reason="pressure")
+        try:
+            return await self._hedged(call, model_name, priority, timeout or self.timeout, hedge)
+        except Exception as e:
+            overloaded = isinstance(e, asyncio.TimeoutError) or is_rate_limit_error(e)
+            if not (overloaded and retry and allow_fallback and self.fallback_model_name
+                    and model_name != self.fallback_model_name):
+                raise
+            print(f"[WARN] {model_name} overloaded ({type(e).__name__}); retrying on {self.fallback_model_name}")
+            llm_fallbacks_counter.inc(reason="retry")
+            return await self._attempt(call, self.fallback_model_name, priority, timeout or self.timeout)
+
+    async def _hedged(self, call, model_name, priority, timeout, hedge):
+        if not hedge or not self.hedge_after:
+            return await self._attempt(call, model_name, priority, timeout)
+        first = asyncio.create_task(self._attempt(call, model_name, priority, timeout))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+            if done or not self.limiter.try_acquire():
+                return await first
+            llm_hedges_counter.inc(priority=PRIORITY_NAMES.get(priority, str(priority)))
+            tasks.add(asyncio.create_task(self._attempt(call, model_name, priority, timeout, slot_held=True)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also runs when the caller is cancelled, so no attempt keeps its Gemini call and slot
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _attempt(self, call, model_name, priority, timeout, slot_held: bool = False):
+        labels = {"model": model_name, "priority": PRIORITY_NAMES.get(priority, str(priority))}
+        if not slot_held:
+            queued = time.perf_counter()
+            await self.limiter.acquire(priority)
+            llm_queue_histogram.observe(time.perf_counter() - queued, priority=labels["priority"])
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(call(model_name), timeout)
+        except asyncio.TimeoutError:
+            self._overloaded()
+            llm_requests_counter.inc(outcome="timeout", **labels)
+            raise
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self._overloaded()
+                llm_requests_counter.inc(outcome="rate_limited", **labels)
+            else:
+                llm_requests_counter.inc(outcome="error", **labels)
+            raise
+        else:
+            latency = time.perf_counter() - started
+            llm_requests_counter.inc(outcome="ok", **labels)
+            llm_latency_histogram.observe(latency, **labels)
+            if priority == PRIORITY_CHAT:
+                # A stale average restarts from this sample rather than decaying from old highs
+                previous = self._recent_chat_latency()
+                self._chat_latency = latency if previous is None else 0.8 * previous + 0.2 * latency
+                self._chat_latency_at = time.monotonic()
+                if latency > self.latency_slo:
+                    # Slow but successful: back off gently rather than halving
+                    self.limiter.on_overload(factor=0.9)
+                    return result
+            self.limiter.on_success()
+            return result
+        finally:
+            self.limiter.release()
+
+    def _overloaded(self):
+        self._last_overload = time.monotonic()
+        self.limiter.on_overload()
@@ -0,0 +1,203 @@
+"""
+Shared model server for multi-worker deployments.
+
+One process owns the SentenceTransformer models; API workers send encode
+requests over a Unix socket and get float32 matrices back. Run it with:
+
+    python -m model_server --socket /tmp/urduwhiz-models.sock
+
+and start the API workers with ``MODEL_SERVER_SOCKET`` pointing at the same
+path. Without that variable ``advance_rag`` keeps loading the models in-process.
+
+Wire format (both directions): a 4-byte big-endian header length, a JSON
+header, then for successful responses the raw C-ordered float32 payload
+described by ``header["shape"]``.
+"""
+import os
+import json
+import struct
+import socket
+import asyncio
+import argparse
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/distiluse-base-multilingual-cased-v2"
+RERANKER_MODEL_NAME = "distiluse-base-multilingual-cased-v2"
+DEFAULT_SOCKET_PATH = "/tmp/urduwhiz-models.sock"
+
+_HEADER_LEN = struct.Struct(">I")
+
+
+def _encode_header(header: dict) -> bytes:
+    raw = json.dumps(header).encode("utf-8")
+    return _HEADER_LEN.pack(len(raw)) + raw
+
+
+# --- CLIENT ---
+class ModelClient:
+    """Blocking client for the model server; keeps one connection per thread."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    @staticmethod
+    def _recv_into(sock, buffer):
+        view = memoryview(buffer)
+        while view:
+            received = sock.recv_into(view)
+            if not received:
+                raise ConnectionError("Model server closed the connection")
+            view = view[received:]
+
+    def _request(self, header: dict) -> np.ndarray:
+        sock = self._connection()
+        sock.sendall(_encode_header(header))
+        size = bytearray(_HEADER_LEN.size)
+        self._recv_into(sock, size)
+        raw_header = bytearray(_HEADER_LEN.unpack(size)[0])
+        self._recv_into(sock, raw_header)
+        response = json.loads(raw_header)
+        if not response.get("ok"):
+            raise RuntimeError(f"Model server error: {response.get('error')}")
+        shape = tuple(response["shape"])
+        payload = bytearray(int(np.prod(shape)) * 4)
+        self._recv_into(sock, payload)
+        # np.frombuffer wraps the receive buffer without copying it.
+        return np.frombuffer(payload, dtype=np.float32).reshape(shape)
+
+    def encode(self, model: str, texts: List[str]) -> np.ndarray:
+        """Encode ``texts`` with the named server-side model ("embedding" or "reranker")."""
+        header = {"op": "encode", "model": model, "texts": list(texts)}
+        try:
+            return self._request(header)
+        except (ConnectionError, OSError):
+            # Stale connection (server restarted); retry once on a fresh socket.
+            self._reset()
+            return self._request(header)
+
+
+class RemoteEmbeddings(Embeddings):
+    """LangChain embeddings backed by the shared model server."""
+
+    def __init__(self, client: ModelClient, model: str = "embedding"):
+        self.client = client
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.client.encode(self.model, texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class RemoteSentenceEncoder:
+    """Drop-in for the subset of SentenceTransformer.encode used by the RAG node."""
+
+    def __init__(self, client: ModelClient, model: str = "reranker"):
+        self.client = client
+        self.model = model
+
+    def encode(self, sentences, convert_to_tensor: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        vectors = self.client.encode(self.model, [sentences] if single else sentences)
+        if single:
+            vectors = vectors[0]
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(vectors)
+        return vectors
+
+
+# --- SERVER ---
+def load_server_models():
+    """Load the models owned by the server process and return encode functions by name."""
+    from sentence_transformers import SentenceTransformer
+
+    embedder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    reranker = SentenceTransformer(RERANKER_MODEL_NAME)
+
+    def encode_embedding(texts):
+        # Same preprocessing as HuggingFaceEmbeddings so vectors match in-process mode.
+        texts = [t.replace("\n", " ") for t in texts]
+        return list(np.asarray(embedder.encode(texts), dtype=np.float32))
+
+    def encode_reranker(texts):
+        return list(np.asarray(reranker.encode(texts), dtype=np.float32))
+
+    return {"embedding": encode_embedding, "reranker": encode_reranker}
+
+
+async def serve(socket_path: str = DEFAULT_SOCKET_PATH, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+    """Run the model server until cancelled."""
+    from backend.utils.batcher import MicroBatcher
+
+    print("[INFO] Loading models...")
+    batchers = {
+        name: MicroBatcher(fn, name=f"server-{name}", max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        for name, fn in load_server_models().items()
+    }
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    size = await reader.readexactly(_HEADER_LEN.size)
+                except asyncio.IncompleteReadError:
+                    break
+                request = json.loads(await reader.readexactly(_HEADER_LEN.unpack(size)[0]))
+                try:
+                    batcher = batchers.get(request.get("model"))
+                    if request.get("op") != "encode" or batcher is None:
+                        raise ValueError(f"Unsupported request: op={request.get('op')} model={request.get('model')}")
+                    texts = request.get("texts") or []
+                    rows = await batcher.submit_many(texts)
+                    matrix = np.ascontiguousarray(np.stack(rows) if rows else np.zeros((0, 0)), dtype=np.float32)
+                except Exception as e:
+                    writer.write(_encode_header({"ok": False, "error": str(e)}))
+                else:
+                    writer.write(_encode_header({"ok": True, "shape": list(matrix.shape)}))
+                    writer.write(memoryview(matrix).cast("B"))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    print(f"[INFO] Model server listening on {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve UrduWhiz embedding/reranker models over a Unix socket.")
+    parser.add_argument("--socket", default=os.getenv("MODEL_SERVER_SOCKET", DEFAULT_SOCKET_PATH))
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.max_batch_size, args.max_wait_ms))
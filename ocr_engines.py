@@ -0,0 +1,291 @@
+"""
+Pluggable OCR engines for scanned Urdu pages.
+
+- ``GeminiEngine`` wraps the gateway-scheduled Gemini OCR call and sends
+  a few pages per request.
+- ``TesseractEngine`` runs Tesseract's ``urd`` model locally in a process
+  pool, fully offline on CPU, and reports a per-page confidence (mean word
+  confidence, 0-1).
+
+``OCRRouter`` picks engines by policy:
+
+- ``gemini``: Gemini only (the original behaviour);
+- ``local``: Tesseract only, no network calls;
+- ``local-first``: Tesseract everywhere, Gemini re-reads pages whose
+  confidence is below ``min_confidence`` (the local text is kept if that fails)
+  and pages Tesseract failed on;
+- ``gemini-first``: Gemini, with Tesseract for page batches Gemini fails on
+  (quota, timeouts, outages).
+
+Every page gets a record (engine, confidence, seconds), and a summary with
+pages per engine and pages/second is returned alongside the text.
+
+Offline check of a PDF: ``python -m ocr_engines book.pdf --output book.txt``
+"""
+import os
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from backend.utils.metrics import counter, histogram
+
+POLICY_GEMINI = "gemini"
+POLICY_LOCAL = "local"
+POLICY_LOCAL_FIRST = "local-first"
+POLICY_GEMINI_FIRST = "gemini-first"
+POLICIES = (POLICY_GEMINI, POLICY_LOCAL, POLICY_LOCAL_FIRST, POLICY_GEMINI_FIRST)
+
+ocr_pages_counter = counter("ocr_pages_total", "OCR'd pages by engine and outcome")
+ocr_page_seconds_histogram = histogram(
+    "ocr_page_seconds", "OCR time per page by engine",
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+ocr_confidence_histogram = histogram(
+    "ocr_page_confidence", "Tesseract mean word confidence per page",
+    buckets=(0.3, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+
+
+def _tesseract_page(image_path: str, lang: str, config: str) -> dict:
+    """OCR one page in a pool worker; words are regrouped into lines and paragraphs."""
+    import pytesseract
+    from PIL import Image
+    started = time.perf_counter()
+    with Image.open(image_path) as image:
+        data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    paragraphs, confidences = {}, []
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        confidence = float(data["conf"][i])
+        if not word or confidence < 0:
+            continue
+        paragraph = paragraphs.setdefault((data["block_num"][i], data["par_num"][i]), {})
+        paragraph.setdefault(data["line_num"][i], []).append(word)
+        confidences.append(confidence)
+    text = "\n\n".join(
+        "\n".join(" ".join(words) for words in lines.values())
+        for lines in paragraphs.values()
+    )
+    return {
+        "text": text,
+        "confidence": round(sum(confidences) / len(confidences) / 100, 3) if confidences else 0.0,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+class TesseractEngine:
+    """Local Tesseract OCR; pages run in parallel in a process pool created on first use."""
+
+    name = "tesseract"
+
+    def __init__(self, lang: str = "urd", workers: int = None, config: str = "--oem 1 --psm 6"):
+        self.lang = lang
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.config = config
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the host process holds torch models, Motor and event-loop threads
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def ocr_pages(self, image_paths: list) -> list:
+        """One record per page: text, confidence, seconds; or the exception the page raised."""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, _tesseract_page, path, self.lang, self.config) for path in image_paths
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                ocr_pages_counter.inc(engine=self.name, outcome="error")
+                continue
+            ocr_pages_counter.inc(engine=self.name, outcome="ok")
+            ocr_page_seconds_histogram.observe(result["seconds"], engine=self.name)
+            ocr_confidence_histogram.observe(result["confidence"])
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class GeminiEngine:
+    """Gemini OCR through ``ocr(image_paths, instruction)``; no per-page confidence."""
+
+    name = "gemini"
+
+    def __init__(self, ocr, pages_per_call: int = 10):
+        self.ocr = ocr
+        self.pages_per_call = pages_per_call
+
+    async def ocr_batch(self, image_paths: list, instruction: str) -> dict:
+        started = time.perf_counter()
+        try:
+            text = await self.ocr(image_paths, instruction)
+        except Exception:
+            ocr_pages_counter.inc(len(image_paths), engine=self.name, outcome="error")
+            raise
+        seconds = time.perf_counter() - started
+        ocr_pages_counter.inc(len(image_paths), engine=self.name, outcome="ok")
+        ocr_page_seconds_histogram.observe(seconds / len(image_paths), engine=self.name)
+        return {"text": (text or "").strip(), "confidence": None, "seconds": seconds}
+
+
+def _page_record(page: int, engine: str, result: dict, seconds: float = None) -> dict:
+    return {
+        "page": page,
+        "engine": engine,
+        "confidence": result.get("confidence"),
+        "seconds": round(result["seconds"] if seconds is None else seconds, 3),
+    }
+
+
+class OCRRouter:
+    """Chooses between a Gemini and a local engine per page according to a policy."""
+
+    def __init__(self, gemini: GeminiEngine, local: TesseractEngine, policy: str = POLICY_GEMINI,
+                 min_confidence: float = 0.75):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown OCR policy '{policy}'; expected one of {', '.join(POLICIES)}")
+        self.gemini = gemini
+        self.local = local
+        self.policy = policy
+        self.min_confidence = min_confidence
+
+    def _batches(self, count: int, pages_per_call: int = None) -> list:
+        size = max(1, pages_per_call or self.gemini.pages_per_call)
+        return [list(range(i, min(i + size, count))) for i in range(0, count, size)]
+
+    def close(self):
+        """Shut down the local engine's process pool, if it was started."""
+        if self.local is not None:
+            self.local.close()
+
+    async def extract_text(self, image_paths: list, instruction: str, policy: str = None,
+                           pages_per_call: int = None):
+        """Return (text, report) for pages in order; see the module docstring for the policies."""
+        policy = policy or self.policy
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown OCR policy '{policy}'; expected one of {', '.join(POLICIES)}")
+        started = time.perf_counter()
+        # One entry per Gemini batch or local page, keyed by its first page, so text stays in page order
+        texts, pages = {}, []
+
+        async def run_local(indices, raise_errors=True):
+            results = await self.local.ocr_pages([image_paths[i] for i in indices])
+            errors = [(i, result) for i, result in zip(indices, results) if isinstance(result, Exception)]
+            if errors and raise_errors:
+                raise errors[0][1]
+            for i, result in zip(indices, results):
+                if isinstance(result, Exception):
+                    continue
+                texts[i] = result["text"]
+                pages.append(_page_record(i + 1, self.local.name, result))
+            return results
+
+        async def run_gemini(indices, fallback_to_local):
+            try:
+                result = await self.gemini.ocr_batch([image_paths[i] for i in indices], instruction)
+            except Exception as e:
+                if not fallback_to_local:
+                    raise
+                print(f"[WARN] Gemini OCR failed for pages {indices[0] + 1}-{indices[-1] + 1} "
+                      f"({type(e).__name__}); using {self.local.name}")
+                await run_local(indices)
+                return
+            texts[indices[0]] = result["text"]
+            per_page = result["seconds"] / len(indices)
+            pages.extend(_page_record(i + 1, self.gemini.name, result, per_page) for i in indices)
+
+        if policy == POLICY_LOCAL:
+            await run_local(list(range(len(image_paths))))
+        elif policy in (POLICY_GEMINI, POLICY_GEMINI_FIRST):
+            await asyncio.gather(*(
+                run_gemini(batch, fallback_to_local=policy == POLICY_GEMINI_FIRST)
+                for batch in self._batches(len(image_paths), pages_per_call)
+            ))
+        else:
+            # Pages Tesseract failed on (missing binary or traineddata, unreadable image) go to Gemini too
+            results = await run_local(list(range(len(image_paths))), raise_errors=False)
+            failed = {i for i, result in enumerate(results) if isinstance(result, Exception)}
+            if failed:
+                print(f"[WARN] {self.local.name} failed on {len(failed)} pages "
+                      f"({type(results[min(failed)]).__name__}: {results[min(failed)]}); using Gemini")
+            retry = [i for i, result in enumerate(results)
+                     if i in failed or not result["text"] or result["confidence"] < self.min_confidence]
+            if len(retry) > len(failed):
+                print(f"[INFO] Re-reading {len(retry) - len(failed)} low-confidence pages with Gemini")
+            if retry:
+                retried = await asyncio.gather(
+                    *(self.gemini.ocr_batch([image_paths[i]], instruction) for i in retry),
+                    return_exceptions=True,
+                )
+                for i, result in zip(retry, retried):
+                    if isinstance(result, Exception):
+                        if i in failed:
+                            # Neither engine could read this page
+                            raise result
+                        print(f"[WARN] Gemini OCR failed for page {i + 1} ({type(result).__name__}); keeping local text")
+                        continue
+                    texts[i] = result["text"]
+                    pages[:] = [p for p in pages if p["page"] != i + 1]
+                    record = _page_record(i + 1, self.gemini.name, result)
+                    if i not in failed:
+                        record["local_confidence"] = results[i]["confidence"]
+                    pages.append(record)
+
+        pages.sort(key=lambda p: p["page"])
+        elapsed = time.perf_counter() - started
+        text = "\n\n".join(texts[i] for i in sorted(texts) if texts[i])
+        local_confidences = [p["confidence"] for p in pages if p["confidence"] is not None]
+        engine_pages = {}
+        for page in pages:
+            engine_pages[page["engine"]] = engine_pages.get(page["engine"], 0) + 1
+        report = {
+            "policy": policy,
+            "pages": pages,
+            "engine_pages": engine_pages,
+            "mean_local_confidence": round(sum(local_confidences) / len(local_confidences), 3) if local_confidences else None,
+            "pages_per_second": round(len(image_paths) / elapsed, 2) if elapsed else None,
+            "seconds": round(elapsed, 3),
+        }
+        return text, report
+
+
+async def _main(args):
+    import tempfile
+    import fitz  # PyMuPDF
+    engine = TesseractEngine(lang=args.lang, workers=args.workers)
+    router = OCRRouter(gemini=None, local=engine, policy=POLICY_LOCAL)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_paths = []
+        with fitz.open(args.pdf) as pdf:
+            for i, page in enumerate(pdf):
+                path = os.path.join(temp_dir, f"page_{i + 1}.jpg")
+                page.get_pixmap(dpi=args.dpi).save(path)
+                image_paths.append(path)
+        text, report = await router.extract_text(image_paths, instruction=None)
+    engine.close()
+    for page in report["pages"]:
+        print(f"[INFO] page {page['page']}: confidence {page['confidence']:.2f}, {page['seconds']:.2f}s")
+    print(f"[INFO] {len(image_paths)} pages, mean confidence {report['mean_local_confidence']}, "
+          f"{report['pages_per_second']} pages/s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m ocr_engines", description="Offline Tesseract OCR of a scanned PDF")
+    parser.add_argument("pdf")
+    parser.add_argument("--output", help="write the text here instead of printing it")
+    parser.add_argument("--lang", default="urd")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dpi", type=int, default=300)
+    asyncio.run(_main(parser.parse_args()))
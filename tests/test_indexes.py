@@ -0,0 +1,50 @@
+"""
+Hot queries must be served by the indexes declared in backend/utils/indexes.py.
+
+Runs against the MongoDB in TEST_MONGO_URI (default mongodb://localhost:27017)
+and is skipped when it is unreachable. Indexes are created in that server's
+UrduWhiz database, so do not point it at production.
+"""
+import os
+import asyncio
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+pytest.importorskip("motor")
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI", "mongodb://localhost:27017")
+
+# backend.config requires these; only MONGO_URI is used here
+os.environ["MONGO_URI"] = TEST_MONGO_URI
+for name in ("SECRET_KEY", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET", "GOOGLE_REDIRECT_URI",
+             "MAIL_USERNAME", "MAIL_PASSWORD", "FASTAPI_SECRET_KEY", "GEMINI_API_KEY", "QDRANT_URL",
+             "QDRANT_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "HF_HOME"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("MAIL_FROM", "test@example.com")
+
+
+def _mongo_reachable() -> bool:
+    client = pymongo.MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except pymongo.errors.PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+pytestmark = pytest.mark.skipif(not _mongo_reachable(), reason=f"MongoDB not reachable at {TEST_MONGO_URI}")
+
+
+def test_hot_queries_use_indexes():
+    from backend.utils.indexes import HOT_QUERIES, ensure_indexes, verify_query_plans
+
+    async def check():
+        await ensure_indexes()
+        return await verify_query_plans()
+
+    plans = asyncio.run(check())
+    assert set(plans) == {name for name, *_ in HOT_QUERIES}
+    for name, stages in plans.items():
+        assert "IXSCAN" in stages and "COLLSCAN" not in stages, (name, stages)